@@ -0,0 +1,134 @@
+import gc
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+import torch
+from pathlib import Path
+from typing import Callable
+from torchfm._memory import process_peak_rss_mb
+
+
+class Case:
+    def __init__(self, name: str, setup: Callable[[], Callable[[], object]], items: int = 1) -> None:
+        """A hot path to measure. `setup` builds the inputs outside of the measurement and
+        returns the operation to time, which processes `items` samples per call.
+        """
+        self.name = name
+        self.setup = setup
+        self.items = items
+
+
+def measure(
+    case: Case,
+    min_time: float = 1.0,
+    min_runs: int = 10,
+    warmup: int = 3,
+    min_sample_time: float = 1e-3
+) -> dict:
+    """Time `case` until both `min_time` seconds and `min_runs` samples are reached, then run
+    it once more under `tracemalloc` for its peak allocation. The tracing is kept out of the
+    timed calls, its overhead would skew them. Only NumPy and Python allocations are traced,
+    PyTorch's are covered by the peak RSS of the process.
+
+    Operations faster than `min_sample_time` are called several times per sample, as the
+    timer resolution and the loop overhead would otherwise dominate, and the latencies are
+    the averages of the calls of each sample.
+    """
+    op = case.setup()
+    for _ in range(warmup):
+        op()
+    calls = 1
+    while True:
+        tick = time.perf_counter()
+        for _ in range(calls):
+            op()
+        if time.perf_counter() - tick >= min_sample_time:
+            break
+        calls *= 2
+    gc.collect()
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < min_runs or time.perf_counter() - start < min_time:
+        tick = time.perf_counter_ns()
+        for _ in range(calls):
+            op()
+        latencies.append((time.perf_counter_ns() - tick) / calls)
+
+    tracemalloc.start()
+    op()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies, dtype=np.float64) / 1e6
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        "runs": len(latencies) * calls,
+        "calls_per_sample": calls,
+        "items": case.items,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p99_ms": float(p99),
+        "throughput": float(case.items / latencies.mean() * 1e3),
+        "traced_peak_mb": traced_peak / 2**20,
+        # Every case runs in its own process, whose peak is the one of the case
+        "peak_rss_mb": process_peak_rss_mb()
+    }
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "threads": torch.get_num_threads(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> list[str]:
+    """Compare the p50 latency and the traced peak memory of every case against a baseline.
+
+    Returns:
+        list[str]: Regressions, the cases slower or larger than `1 + tolerance` times the
+            baseline. Cases missing from either side are ignored.
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for key in ["p50_ms", "traced_peak_mb"]:
+            # Sub-KiB allocations are noise
+            if key == "traced_peak_mb" and base[key] < 1 / 1024:
+                continue
+            ratio = result[key] / base[key] if base[key] > 0 else 1.0
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name}: {key} {base[key]:.4f} -> {result[key]:.4f} ({ratio:.2f}x)")
+    return regressions
+
+
+def report(results: dict, baseline: dict = None) -> str:
+    lines = [f"{'case':<28}{'p50 ms':>10}{'p99 ms':>10}{'items/s':>14}{'traced MiB':>12}{'vs base':>9}"]
+    for name, r in results["results"].items():
+        base = (baseline or {"results": {}})["results"].get(name)
+        ratio = f"{r['p50_ms'] / base['p50_ms']:.2f}x" if base and base["p50_ms"] > 0 else "-"
+        lines.append(
+            f"{name:<28}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['throughput']:>14.0f}"
+            f"{r['traced_peak_mb']:>12.2f}{ratio:>9}"
+        )
+    return "\n".join(lines)
+
+
+def write(path: str | Path, results: dict) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2))
+
+
+def read(path: str | Path) -> dict:
+    return json.loads(Path(path).read_text())
@@ -0,0 +1,197 @@
+"""Benchmark the hot paths of torchfm on synthetic data, offline and reproducibly.
+
+    python benchmarks/run.py --size small --output results.json
+    python benchmarks/run.py --size small --baseline baseline.json --tolerance 0.2
+
+Every case runs in its own process, so the peak RSS it reports is not inflated by the
+previous ones. With `--baseline` the exit status is 1 when a case regressed.
+"""
+import argparse
+import multiprocessing
+import sys
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from torchfm.data import synthetic
+from torchfm.data.data_utils import encode
+from torchfm.model import TorchFM
+from torchfm.model._loss import WARPLoss
+from torchfm.model.evaluation import auc_score
+from harness import Case
+from harness import compare
+from harness import environment
+from harness import measure
+from harness import read
+from harness import report
+from harness import write
+
+SIZES = {
+    "small": {"num_users": 1_000, "num_items": 500, "num_features": 20, "density": 0.02},
+    "medium": {"num_users": 20_000, "num_items": 5_000, "num_features": 200, "density": 0.002},
+    "large": {"num_users": 200_000, "num_items": 50_000, "num_features": 1_000, "density": 0.0002}
+}
+
+
+def _dataset(config: dict, **kwargs):
+    return synthetic.load(
+        num_users=config["num_users"],
+        num_items=config["num_items"],
+        num_user_features=config["num_features"],
+        num_item_features=config["num_features"],
+        user_features_per_row=config["features_per_row"],
+        item_features_per_row=config["features_per_row"],
+        density=config["density"],
+        seed=config["seed"],
+        **kwargs
+    )
+
+
+def _indices(config: dict, dataset, n: int) -> np.ndarray:
+    return np.random.default_rng(config["seed"]).integers(0, len(dataset), n)
+
+
+def cases(config: dict) -> list[Case]:
+    batch_size = config["batch_size"]
+    num_negatives = config["num_negatives"]
+
+    def getitem(use_cache):
+        def setup():
+            dataset = _dataset(config, use_cache=use_cache)
+            indices = _indices(config, dataset, batch_size).tolist()
+            return lambda: [dataset[i] for i in indices]
+        return setup
+
+    def get_batch(sparse):
+        def setup():
+            dataset = _dataset(config, sparse=sparse)
+            indices = _indices(config, dataset, batch_size)
+            return lambda: dataset.get_batch(indices)
+        return setup
+
+    def encode_features():
+        dataset = _dataset(config)
+        # The vocabulary of `synthetic.load`, ids first
+        num_users = config["num_users"]
+        vocab = {id: id for id in range(num_users)}
+        vocab.update({f"user_feature::{j}": num_users + j for j in range(config["num_features"])})
+        inputs = [dataset.get_user_features_by_id(id) + [id] for id in range(min(batch_size, num_users))]
+        return lambda: [encode(x, vocab) for x in inputs]
+
+    def forward(sparse):
+        def setup():
+            dataset = _dataset(config, sparse=sparse)
+            torch.manual_seed(config["seed"])
+            model = TorchFM(dataset.user_input_dim, dataset.item_input_dim, sparse=sparse)
+            *inputs, _ = dataset.get_batch(_indices(config, dataset, batch_size))
+
+            @torch.no_grad()
+            def op():
+                return model(*inputs)
+            return op
+        return setup
+
+    def warp_loss():
+        generator = torch.Generator().manual_seed(config["seed"])
+        pos = torch.randn(batch_size, generator=generator, requires_grad=True)
+        neg = torch.randn(batch_size, num_negatives, generator=generator, requires_grad=True)
+        criterion = WARPLoss(num_items=config["num_items"])
+
+        def op():
+            criterion(pos, neg).backward()
+        return op
+
+    def auc():
+        rng = np.random.default_rng(config["seed"])
+        scores = rng.standard_normal(config["num_items"])
+        labels = (rng.random(config["num_items"]) < max(config["density"], 0.01)).astype(np.int8)
+        labels[0] = 1
+        return lambda: auc_score(scores, labels)
+
+    return [
+        Case("dataset.getitem", getitem(use_cache=False), batch_size),
+        Case("dataset.getitem_cached", getitem(use_cache=True), batch_size),
+        Case("dataset.get_batch", get_batch(sparse=False), batch_size),
+        Case("dataset.get_batch_sparse", get_batch(sparse=True), batch_size),
+        Case("data_utils.encode", encode_features, min(batch_size, config["num_users"])),
+        Case("model.forward", forward(sparse=False), batch_size),
+        Case("model.forward_sparse", forward(sparse=True), batch_size),
+        Case("loss.warp", warp_loss, batch_size),
+        Case("evaluation.auc_score", auc, config["num_items"])
+    ]
+
+
+def run_case(name: str, config: dict) -> dict:
+    torch.set_num_threads(config["threads"])
+    case = next(c for c in cases(config) if c.name == name)
+    return measure(case, min_time=config["min_time"], min_runs=config["min_runs"])
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of torchfm.")
+    parser.add_argument("--size", choices=list(SIZES), default="small")
+    parser.add_argument("--num-users", type=int)
+    parser.add_argument("--num-items", type=int)
+    parser.add_argument("--num-features", type=int, help="Features of the users and of the items")
+    parser.add_argument("--density", type=float, help="Fraction of the user-item pairs interacted")
+    parser.add_argument("--features-per-row", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--num-negatives", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=1, help="PyTorch intra-op threads")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to time each case")
+    parser.add_argument("--min-runs", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--filter", default="", help="Only run the cases whose name contains it")
+    parser.add_argument("--no-isolate", action="store_true", help="Run every case in this process")
+    parser.add_argument("--output", help="Write the results as JSON there")
+    parser.add_argument("--baseline", help="Results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown or growth over the baseline, 0.2 for 20%%")
+    args = parser.parse_args(argv)
+
+    config = dict(SIZES[args.size])
+    for key in ["num_users", "num_items", "num_features", "density"]:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    config.update({
+        "size": args.size,
+        "features_per_row": args.features_per_row,
+        "batch_size": args.batch_size,
+        "num_negatives": args.num_negatives,
+        "threads": args.threads,
+        "min_time": args.min_time,
+        "min_runs": args.min_runs,
+        "seed": args.seed
+    })
+
+    names = [c.name for c in cases(config) if args.filter in c.name]
+    results = {"environment": environment(), "config": config, "results": {}}
+    for name in names:
+        logger.info(f"Running {name}.")
+        if args.no_isolate:
+            results["results"][name] = run_case(name, config)
+        else:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results["results"][name] = executor.submit(run_case, name, config).result()
+
+    baseline = read(args.baseline) if args.baseline else None
+    print(report(results, baseline))
+    if args.output:
+        write(args.output, results)
+        logger.info(f"Saved results to {args.output}")
+    if baseline is None:
+        return 0
+
+    if baseline["config"] != config:
+        logger.warning("The baseline was run with another config, the comparison may not hold.")
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        logger.error(f"Regression {regression}")
+    if not regressions:
+        logger.info(f"No regression beyond {args.tolerance:.0%} of the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import os
+import sys
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MiB, NaN where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return float("nan")
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def process_peak_rss_mb() -> float:
+    """Highest resident set size of this process since it started, in MiB. It never goes
+    down, NaN where `resource` is unavailable.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KiB on Linux and in bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
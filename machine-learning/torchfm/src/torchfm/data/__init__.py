@@ -1,3 +1,6 @@
 from torchfm.data._fmdataset import FMDataset
+from torchfm.data._sampler import FMBatchSampler
+from torchfm.data._pairwise import NegativeSampler
+from torchfm.data._pairwise import PairwiseFMDataset
 
-__all__ = ["FMDataset"]
\ No newline at end of file
+__all__ = ["FMDataset", "FMBatchSampler", "NegativeSampler", "PairwiseFMDataset"]
\ No newline at end of file
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from typing import Hashable
+from torch import Tensor
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        """A least-recently-used cache of tensors bounded by the total size of their payload.
+
+        Args:
+            max_bytes (int): Byte budget, the oldest entries are evicted once it is exceeded.
+        """
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, Tensor] = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _sizeof(value: Tensor) -> int:
+        return value.element_size() * value.nelement()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key: Hashable) -> Tensor | None:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Tensor) -> None:
+        size = self._sizeof(value)
+        if size > self._max_bytes:
+            return
+
+        if key in self._entries:
+            self._nbytes -= self._sizeof(self._entries.pop(key))
+
+        self._entries[key] = value
+        self._nbytes += size
+        while self._nbytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= self._sizeof(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._nbytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._nbytes,
+            "max_bytes": self._max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
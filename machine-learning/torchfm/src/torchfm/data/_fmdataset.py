@@ -1,9 +1,46 @@
-import bisect
+import json
 import torch
+import numpy as np
+from pathlib import Path
 from loguru import logger
 from torch import Tensor
 from torch.utils.data import Dataset
+from torchfm.data._cache import LRUCache
+from torchfm.data._index import InteractionIndex
 from torchfm.data.data_utils import encode
+from torchfm.data.data_utils import encode_indices
+from torchfm.data.data_utils import csr_gather
+from torchfm.data.data_utils import to_many_hot
+
+# Arrays describing a dataset: the users/items sorted by id with their features as CSR
+# matrices, and the interactions as the row of their user and item.
+ARRAYS = (
+    "user_ids", "user_indptr", "user_indices",
+    "item_ids", "item_indptr", "item_indices",
+    "user_rows", "item_rows", "ratings"
+)
+
+def index_arrays(prefix: str, index: InteractionIndex) -> dict[str, np.ndarray]:
+    return {
+        f"{prefix}_index_pairs": index.pairs,
+        f"{prefix}_index_positions": index.positions,
+        f"{prefix}_index_indptr": index.indptr
+    }
+
+def write_arrays(path: str | Path, arrays: dict[str, np.ndarray]) -> None:
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(path.joinpath(f"{name}.npy"), array)
+
+def write_vocab(path: str | Path, user_features: dict, item_features: dict) -> None:
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path.joinpath("vocab.json"), "w") as f:
+        json.dump({
+            "user_features": list(user_features.items()),
+            "item_features": list(item_features.items())
+        }, f)
 
 class FMDataset(Dataset):
     def __init__(
@@ -14,19 +51,289 @@ class FMDataset(Dataset):
         user_features: dict[str, int],
         item_features: dict[str, int],
         use_cache: bool=True,
+        cache_bytes: int=64 * 1024 * 1024,
+        sparse: bool=False,
+        verbose: bool=False
+    ) -> None:
+        """The user and item features are compiled once into CSR matrices (`indptr`, `indices`)
+        whose rows are the users/items sorted by id, and the interactions into flat arrays of
+        row numbers, so serving a sample or a whole batch is only array slicing. The interactions
+        are also indexed per user and per item, see `InteractionIndex`.
+
+        Args:
+            use_cache (bool): Keep the encoded features of recently served users and items.
+            cache_bytes (int): Memory budget of the cache, least recently used entries are
+                evicted beyond it. Every `DataLoader` worker holds its own cache.
+            sparse (bool): Serve feature indices instead of dense many-hot vectors, in the
+                `nn.EmbeddingBag` layout (indices, offsets) once batched.
+        """
+        user_info = sorted(user_info, key=lambda x: x[0])
+        item_info = sorted(item_info, key=lambda x: x[0])
+        user_ids, user_indptr, user_indices = self._build_csr(user_info, user_features)
+        item_ids, item_indptr, item_indices = self._build_csr(item_info, item_features)
+
+        if len(interactions) > 0:
+            interacted_users, interacted_items, ratings = zip(*interactions)
+        else:
+            interacted_users, interacted_items, ratings = [], [], []
+
+        arrays = {
+            "user_ids": user_ids,
+            "user_indptr": user_indptr,
+            "user_indices": user_indices,
+            "item_ids": item_ids,
+            "item_indptr": item_indptr,
+            "item_indices": item_indices,
+            "user_rows": self._find_rows(user_ids, interacted_users, "User"),
+            "item_rows": self._find_rows(item_ids, interacted_items, "Item"),
+            "ratings": np.asarray(ratings, dtype=np.float32)
+        }
+        self._setup(arrays, user_features, item_features, use_cache, cache_bytes, sparse, verbose)
+
+    def _setup(
+        self,
+        arrays: dict[str, np.ndarray],
+        user_features: dict[str, int],
+        item_features: dict[str, int],
+        use_cache: bool=True,
+        cache_bytes: int=64 * 1024 * 1024,
+        sparse: bool=False,
         verbose: bool=False
     ) -> None:
         self.user_input_dim = len(user_features)
         self.item_input_dim = len(item_features)
-        self._interactions = interactions
-        self._user_info = sorted(user_info, key=lambda x: x[0])
-        self._item_info = sorted(item_info, key=lambda x: x[0])
+        self.sparse = sparse
         self._user_features = user_features
         self._item_features = item_features
+        self._user_vocab = self._invert(user_features)
+        self._item_vocab = self._invert(item_features)
         self._verbose = verbose
         self._cache_enabled = use_cache
         if use_cache:
-            self._cache = {}
+            self._cache = LRUCache(cache_bytes)
+
+        for name in ARRAYS:
+            setattr(self, "_" + name, arrays[name])
+
+        if "user_index_pairs" in arrays:
+            self._user_index = InteractionIndex.restore(
+                arrays["user_index_pairs"], arrays["user_index_positions"],
+                arrays["user_index_indptr"], self.num_users, self.num_items)
+            self._item_index = InteractionIndex.restore(
+                arrays["item_index_pairs"], arrays["item_index_positions"],
+                arrays["item_index_indptr"], self.num_items, self.num_users)
+        else:
+            self._user_index = InteractionIndex(
+                self._user_rows, self._item_rows, self.num_users, self.num_items)
+            self._item_index = InteractionIndex(
+                self._item_rows, self._user_rows, self.num_items, self.num_users)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: dict[str, np.ndarray],
+        user_features: dict[str, int],
+        item_features: dict[str, int],
+        **kwargs
+    ) -> "FMDataset":
+        """Create a dataset from already compiled arrays, see `ARRAYS` for their names. The
+        interaction indexes are built unless given as well, as written by `save`.
+        """
+        dataset = cls.__new__(cls)
+        dataset._setup(arrays, user_features, item_features, **kwargs)
+        return dataset
+
+    def save(self, path: str | Path) -> None:
+        """Write the vocabularies and every array to the directory `path`."""
+        arrays = {name: getattr(self, "_" + name) for name in ARRAYS}
+        arrays.update(index_arrays("user", self._user_index))
+        arrays.update(index_arrays("item", self._item_index))
+        write_arrays(path, arrays)
+        write_vocab(path, self._user_features, self._item_features)
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool=True, **kwargs) -> "FMDataset":
+        """Load a dataset written by `save`. With `mmap`, the arrays are memory-mapped instead
+        of read, so they are paged in on demand and shared by every process loading them.
+        """
+        path = Path(path)
+        with open(path.joinpath("vocab.json")) as f:
+            vocab = json.load(f)
+        arrays = {}
+        for file in path.glob("*.npy"):
+            arrays[file.stem] = np.load(file, mmap_mode="r" if mmap else None)
+        return cls.from_arrays(
+            arrays,
+            user_features={k: v for k, v in vocab["user_features"]},
+            item_features={k: v for k, v in vocab["item_features"]},
+            **kwargs
+        )
+
+    @staticmethod
+    def _invert(features: dict[str, int]) -> np.ndarray:
+        vocab = np.empty(len(features), dtype=object)
+        for feature, index in features.items():
+            vocab[index] = feature
+        return vocab
+
+    @staticmethod
+    def _build_csr(
+        info: list[tuple[int, list[str]]],
+        features: dict[str, int]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Build (ids, indptr, indices) where row `r` holds the sorted, de-duplicated feature
+        indices of `ids[r]`, including the id itself as a feature.
+        """
+        ids = np.array([x[0] for x in info], dtype=np.int64)
+        rows = [np.unique([features[f] for f in feats] + [features[id]]) for id, feats in info]
+        lengths = np.array([len(r) for r in rows], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        if len(rows) > 0:
+            indices = np.concatenate(rows).astype(np.int64)
+        else:
+            indices = np.zeros(0, dtype=np.int64)
+        return ids, indptr, indices
+
+    @staticmethod
+    def _find_rows(ids: np.ndarray, values, kind: str) -> np.ndarray:
+        values = np.asarray(values, dtype=np.int64)
+        rows = np.searchsorted(ids, values)
+        found = rows < len(ids)
+        found[found] = ids[rows[found]] == values[found]
+        if not found.all():
+            raise ValueError(f"{kind} info not found: {values[~found][0]}.")
+        return rows
+
+    @property
+    def num_users(self) -> int:
+        return len(self._user_ids)
+
+    @property
+    def num_items(self) -> int:
+        return len(self._item_ids)
+
+    @property
+    def user_features(self) -> dict:
+        """Vocabulary of the user features, mapping a feature or a user id to its index."""
+        return self._user_features
+
+    @property
+    def item_features(self) -> dict:
+        """Vocabulary of the item features, mapping a feature or an item id to its index."""
+        return self._item_features
+
+    def get_user_rows(self, user_ids) -> np.ndarray:
+        """Map user ids to their row in the feature matrices."""
+        return self._find_rows(self._user_ids, user_ids, "User")
+
+    def get_item_rows(self, item_ids) -> np.ndarray:
+        """Map item ids to their row in the feature matrices."""
+        return self._find_rows(self._item_ids, item_ids, "Item")
+
+    def get_user_ids(self, user_rows) -> np.ndarray:
+        return self._user_ids[user_rows]
+
+    def get_item_ids(self, item_rows) -> np.ndarray:
+        return self._item_ids[item_rows]
+
+    def encode_user_rows(self, rows) -> tuple[Tensor, Tensor]:
+        """Returns:
+            tuple[Tensor, Tensor]: Feature indices and offsets of the users, as `TorchFM` expects
+        """
+        u, u_offsets = csr_gather(self._user_indptr, self._user_indices, np.asarray(rows))
+        return torch.from_numpy(u), torch.from_numpy(u_offsets)
+
+    def encode_item_rows(self, rows) -> tuple[Tensor, Tensor]:
+        """Returns:
+            tuple[Tensor, Tensor]: Feature indices and offsets of the items, as `TorchFM` expects
+        """
+        i, i_offsets = csr_gather(self._item_indptr, self._item_indices, np.asarray(rows))
+        return torch.from_numpy(i), torch.from_numpy(i_offsets)
+
+    def get_interacted_item_rows(self, user_rows) -> tuple[np.ndarray, np.ndarray]:
+        """Find the interactions of a group of users.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Position in `user_rows` and item row of every
+                interaction of these users.
+        """
+        groups, positions = self._user_index.gather(user_rows)
+        return groups, self._item_rows[positions]
+
+    def get_non_interacted_item_rows(self, user_row: int) -> np.ndarray:
+        """Sorted rows of the items the user never interacted with."""
+        candidates = np.ones(self.num_items, dtype=bool)
+        candidates[self._user_index.values(user_row)] = False
+        return np.flatnonzero(candidates)
+
+    def is_interacted(self, user_rows, item_rows) -> np.ndarray:
+        """Vectorized test of whether each (user row, item row) pair is an interaction, e.g. to
+        reject sampled negatives. The inputs may be of any broadcastable shape.
+        """
+        return self._user_index.contains(user_rows, item_rows)
+
+    def get_item_counts(self) -> np.ndarray:
+        """Number of interactions of every item row."""
+        return self._item_index.counts()
+
+    def add_interactions(self, interactions: list[tuple[int, int, float]]) -> None:
+        """Append interactions of known users and items, the indexes are merged incrementally."""
+        if len(interactions) == 0:
+            return
+        user_ids, item_ids, ratings = zip(*interactions)
+        user_rows = self.get_user_rows(user_ids)
+        item_rows = self.get_item_rows(item_ids)
+        start = len(self._ratings)
+        self._user_rows = np.concatenate([self._user_rows, user_rows])
+        self._item_rows = np.concatenate([self._item_rows, item_rows])
+        self._ratings = np.concatenate([self._ratings, np.asarray(ratings, dtype=np.float32)])
+        self._user_index.append(user_rows, item_rows, start)
+        self._item_index.append(item_rows, user_rows, start)
+
+    def _get_user_row(self, user_id) -> int:
+        return int(self._find_rows(self._user_ids, [user_id], "User")[0])
+
+    def _get_item_row(self, item_id) -> int:
+        return int(self._find_rows(self._item_ids, [item_id], "Item")[0])
+
+    def _encode_row(self, indptr: np.ndarray, indices: np.ndarray, row: int, dim: int) -> Tensor:
+        u = torch.from_numpy(indices[indptr[row]:indptr[row + 1]].copy())
+        if self.sparse:
+            return u
+        encoded = torch.zeros((dim), dtype=torch.int8)
+        encoded[u] = 1
+        return encoded
+
+    def _encode_cached(self, kind: str, row: int) -> Tensor:
+        if kind == "user":
+            key = (kind, int(self._user_ids[row]))
+            args = (self._user_indptr, self._user_indices, row, self.user_input_dim)
+        else:
+            key = (kind, int(self._item_ids[row]))
+            args = (self._item_indptr, self._item_indices, row, self.item_input_dim)
+
+        if self._cache_enabled:
+            encoded = self._cache.get(key)
+            if encoded is not None:
+                if self._verbose:
+                    logger.info(f"Cache found: {key}.")
+                return encoded
+
+        encoded = self._encode_row(*args)
+        if self._cache_enabled:
+            if self._verbose:
+                logger.info(f"Cache new item: {key}.")
+            self._cache.put(key, encoded)
+        return encoded
+
+    def cache_stats(self) -> dict[str, int]:
+        """Returns:
+            dict[str, int]: Entries, bytes, hits, misses and evictions of the feature cache.
+        """
+        if not self._cache_enabled:
+            return {}
+        return self._cache.stats()
 
     def transform(
         self, 
@@ -40,72 +347,100 @@ class FMDataset(Dataset):
         if item_id is not None:
             item_features = list(set(item_features + [item_id]))
             
-        u = encode(user_features, self._user_features)
-        i = encode(item_features, self._item_features)
+        if self.sparse:
+            u = encode_indices(user_features, self._user_features)
+            i = encode_indices(item_features, self._item_features)
+        else:
+            u = encode(user_features, self._user_features)
+            i = encode(item_features, self._item_features)
         return u, i
     
+    def get_interactions(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: user ids, item ids and ratings
+        """
+        return self._user_ids[self._user_rows], self._item_ids[self._item_rows], self._ratings
+
     def get_interacted_items(self, user_id) -> list[tuple[int, float]]:
-        items = []
-        for it in self._interactions:
-            if it[0] != user_id: continue
-            items.append((it[1], it[2]))
-        return items
+        positions = self._user_index.get(self._get_user_row(user_id))
+        items = self._item_ids[self._item_rows[positions]].tolist()
+        return list(zip(items, self._ratings[positions].tolist()))
+
+    def get_interacted_users(self, item_id) -> list[tuple[int, float]]:
+        positions = self._item_index.get(self._get_item_row(item_id))
+        users = self._user_ids[self._user_rows[positions]].tolist()
+        return list(zip(users, self._ratings[positions].tolist()))
     
-    def get_non_interacted_items(self, user_id) -> list[tuple[int, float]]:
-        items = self.get_all_item_ids()
-        interacted = set([x[0] for x in self.get_interacted_items(user_id)])
-        items = items - interacted
-        return list(items)
+    def get_non_interacted_items(self, user_id) -> list[int]:
+        rows = self.get_non_interacted_item_rows(self._get_user_row(user_id))
+        return self._item_ids[rows].tolist()
     
     def get_user_features_by_id(self, user_id) -> list[str]:
-        u_idx = bisect.bisect_left(self._user_info, user_id, key=lambda x: x[0])
-        u_found = (u_idx < len(self._user_info) and self._user_info[u_idx][0] == user_id)
-        if not u_found:
-            raise ValueError(f"User info not found: {user_id}.")
-        u_info = self._user_info[u_idx]
-        return u_info[1]
+        row = self._get_user_row(user_id)
+        indices = self._user_indices[self._user_indptr[row]:self._user_indptr[row + 1]]
+        return [f for f in self._user_vocab[indices].tolist() if f != user_id]
     
     def get_item_features_by_id(self, item_id) -> list[str]:
-        i_idx = bisect.bisect_left(self._item_info, item_id, key=lambda x: x[0])
-        i_found = (i_idx < len(self._item_info) and self._item_info[i_idx][0] == item_id)
-        if not i_found:
-            raise ValueError(f"Item info not found: {item_id}.")
-        i_info = self._item_info[i_idx]
-        return i_info[1]
+        row = self._get_item_row(item_id)
+        indices = self._item_indices[self._item_indptr[row]:self._item_indptr[row + 1]]
+        return [f for f in self._item_vocab[indices].tolist() if f != item_id]
     
     def get_all_item_ids(self) -> list[int]:
-        items = set([x[0] for x in self._item_info])
+        items = set(self._item_ids.tolist())
         return items
     
     def get_all_user_ids(self) -> list[int]:
-        users = set([x[0] for x in self._user_info])
+        users = set(self._user_ids.tolist())
         return users
     
-    def __len__(self):
-        return len(self._interactions)
-    
-    def __getitem__(self, idx: int):
-        uid, iid, rating = self._interactions[idx]
+    def get_rows(self, indices) -> tuple[np.ndarray, np.ndarray]:
+        """Returns:
+            tuple[np.ndarray, np.ndarray]: User rows and item rows of the given interactions
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return self._user_rows[indices], self._item_rows[indices]
 
-        if self._cache_enabled and idx in self._cache:
-            if self._verbose:
-                logger.info(f"Cache found: {idx}.")
-            u, i = self._cache[idx]
-            return u, i, torch.tensor(rating, dtype=torch.float32)
-        
-        u_feat = self.get_user_features_by_id(uid)
-        i_feat = self.get_item_features_by_id(iid)
-
-        u, i = self.transform(
-            user_id=uid,
-            item_id=iid,
-            user_features=u_feat,
-            item_features=i_feat
-        )
+    def encode_rows(self, user_rows, item_rows) -> tuple[Tensor, ...]:
+        """Encode users and items by slicing the CSR matrices, the number of items may be a
+        multiple of the number of users, see `TorchFM.forward`.
 
-        if self._cache_enabled and idx not in self._cache:
-            if self._verbose:
-                logger.info(f"Cache new item: {idx}.")
-            self._cache[idx] = (u, i)
+        Returns:
+            tuple: (u, i) with many-hot `u`, `i` or (u, i, u_offsets, i_offsets) if sparse,
+                in the order expected by `TorchFM.forward`.
+        """
+        u, u_offsets = csr_gather(self._user_indptr, self._user_indices, np.asarray(user_rows))
+        i, i_offsets = csr_gather(self._item_indptr, self._item_indices, np.asarray(item_rows))
+        if self.sparse:
+            return (
+                torch.from_numpy(u), torch.from_numpy(i),
+                torch.from_numpy(u_offsets), torch.from_numpy(i_offsets)
+            )
+        u = to_many_hot(u, u_offsets, self.user_input_dim)
+        i = to_many_hot(i, i_offsets, self.item_input_dim)
+        return u, i
+
+    def get_batch(self, indices) -> tuple[Tensor, ...]:
+        """Gather a whole batch of interactions at once by slicing the CSR matrices.
+
+        Returns:
+            tuple: (u, i, y) with many-hot `u`, `i` or (u, i, u_offsets, i_offsets, y) if sparse,
+                in the order expected by `TorchFM.forward`.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        user_rows, item_rows = self.get_rows(indices)
+        y = torch.from_numpy(self._ratings[indices])
+        return *self.encode_rows(user_rows, item_rows), y
 
-        return u, i, torch.tensor(rating, dtype=torch.float32)
\ No newline at end of file
+    def __getitems__(self, indices) -> tuple[Tensor, ...]:
+        """Batched access used by `DataLoader`, batches must be collated with
+        `data_utils.collate_batch`.
+        """
+        return self.get_batch(indices)
+
+    def __len__(self):
+        return len(self._ratings)
+    
+    def __getitem__(self, idx: int):
+        u = self._encode_cached("user", self._user_rows[idx])
+        i = self._encode_cached("item", self._item_rows[idx])
+        return u, i, torch.tensor(self._ratings[idx], dtype=torch.float32)
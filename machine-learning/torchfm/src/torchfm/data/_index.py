@@ -0,0 +1,156 @@
+import numpy as np
+from pathlib import Path
+from torchfm.data.data_utils import csr_gather
+
+
+class InteractionIndex:
+    def __init__(
+        self,
+        keys: np.ndarray,
+        values: np.ndarray,
+        num_keys: int,
+        num_values: int
+    ) -> None:
+        """Inverted index from a key row (e.g. a user) to its interactions with value rows
+        (e.g. items). The interactions are kept sorted by the pair `key * num_values + value`,
+        so the interactions of a key are a contiguous slice located by `indptr`, and its values
+        are sorted inside that slice.
+
+        Args:
+            keys (np.ndarray): Key row of every interaction
+            values (np.ndarray): Value row of every interaction
+            num_keys (int): Number of distinct key rows
+            num_values (int): Number of distinct value rows
+        """
+        self._num_keys = num_keys
+        self._num_values = num_values
+        pairs = self._pairs(keys, values)
+        order = np.argsort(pairs, kind="stable")
+        self.pairs = pairs[order]
+        self.positions = order.astype(np.int64)
+        self.indptr = np.searchsorted(self.pairs, np.arange(num_keys + 1) * num_values)
+
+    @classmethod
+    def restore(
+        cls,
+        pairs: np.ndarray,
+        positions: np.ndarray,
+        indptr: np.ndarray,
+        num_keys: int,
+        num_values: int
+    ) -> "InteractionIndex":
+        """Recreate an index from its arrays, e.g. memory-mapped from disk."""
+        index = cls.__new__(cls)
+        index._num_keys = num_keys
+        index._num_values = num_values
+        index.pairs = pairs
+        index.positions = positions
+        index.indptr = indptr
+        return index
+
+    @classmethod
+    def build_on_disk(
+        cls,
+        keys: np.ndarray,
+        values: np.ndarray,
+        num_keys: int,
+        num_values: int,
+        path: Path,
+        prefix: str,
+        chunksize: int = 1_000_000
+    ) -> "InteractionIndex":
+        """Build the index of interactions too many to sort in memory, e.g. memory-mapped
+        columns, into the files "{prefix}_index_{pairs,positions,indptr}.npy" of `path`.
+
+        A first pass counts the interactions of every key, a second scatters their pairs and
+        positions to the slices of their keys, both `chunksize` interactions at a time. Each
+        slice then only needs sorting by value, a few keys at a time. The result is the same
+        as the in-memory build, and memory only holds O(num_keys + chunksize) values.
+        """
+        path = Path(path)
+        length = len(keys)
+        counts = np.zeros(num_keys, dtype=np.int64)
+        for start in range(0, length, chunksize):
+            counts += np.bincount(keys[start:start + chunksize], minlength=num_keys)
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+
+        def open_array(name):
+            return np.lib.format.open_memmap(
+                path.joinpath(f"{prefix}_index_{name}.npy"), mode="w+", dtype=np.int64, shape=(length,))
+        pairs, positions = open_array("pairs"), open_array("positions")
+        cursor = indptr[:-1].copy()
+        for start in range(0, length, chunksize):
+            chunk_keys = np.asarray(keys[start:start + chunksize], dtype=np.int64)
+            order = np.argsort(chunk_keys, kind="stable")
+            sorted_keys = chunk_keys[order]
+            # Rank of every interaction among those of its key in the chunk
+            first = np.searchsorted(sorted_keys, sorted_keys)
+            at = cursor[sorted_keys] + np.arange(len(order)) - first
+            pairs[at] = sorted_keys * num_values + np.asarray(values[start:start + chunksize])[order]
+            positions[at] = start + order
+            cursor += np.bincount(chunk_keys, minlength=num_keys)
+
+        # The slices are in key order, and their interactions in position order, a stable sort
+        # of the pairs of consecutive keys orders them by value as the in-memory build does
+        key = 0
+        while key < num_keys:
+            end = max(int(np.searchsorted(indptr, indptr[key] + chunksize, side="right")) - 1, key + 1)
+            low, high = indptr[key], indptr[end]
+            order = np.argsort(pairs[low:high], kind="stable")
+            pairs[low:high] = pairs[low:high][order]
+            positions[low:high] = positions[low:high][order]
+            key = end
+        pairs.flush()
+        positions.flush()
+        del pairs, positions
+        np.save(path.joinpath(f"{prefix}_index_indptr.npy"), indptr)
+        return cls.restore(
+            np.load(path.joinpath(f"{prefix}_index_pairs.npy"), mmap_mode="r"),
+            np.load(path.joinpath(f"{prefix}_index_positions.npy"), mmap_mode="r"),
+            indptr, num_keys, num_values
+        )
+
+    def _pairs(self, keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+        return np.asarray(keys, dtype=np.int64) * self._num_values + values
+
+    def append(self, keys: np.ndarray, values: np.ndarray, start: int) -> None:
+        """Merge new interactions, stored at positions `start, start + 1, ...`, into the index
+        without sorting the existing ones again.
+        """
+        pairs = self._pairs(keys, values)
+        order = np.argsort(pairs, kind="stable")
+        at = np.searchsorted(self.pairs, pairs[order], side="right")
+        self.pairs = np.insert(self.pairs, at, pairs[order])
+        self.positions = np.insert(self.positions, at, start + order)
+        counts = np.bincount(keys, minlength=self._num_keys)
+        self.indptr = self.indptr + np.concatenate([[0], np.cumsum(counts)])
+
+    def counts(self) -> np.ndarray:
+        """Number of interactions of every key."""
+        return np.diff(self.indptr)
+
+    def get(self, key: int) -> np.ndarray:
+        """Positions of the interactions of `key`, ordered by value."""
+        return self.positions[self.indptr[key]:self.indptr[key + 1]]
+
+    def values(self, key: int) -> np.ndarray:
+        """Sorted value rows `key` interacted with."""
+        return self.pairs[self.indptr[key]:self.indptr[key + 1]] - key * self._num_values
+
+    def gather(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns:
+            tuple[np.ndarray, np.ndarray]: Position in `keys` and interaction position of every
+                interaction of the given keys.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        positions, offsets = csr_gather(self.indptr, self.positions, keys)
+        lengths = np.diff(offsets, append=len(positions))
+        return np.repeat(np.arange(len(keys)), lengths), positions
+
+    def contains(self, keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Vectorized membership test of (key, value) pairs of any broadcastable shape."""
+        pairs = self._pairs(keys, values)
+        at = np.searchsorted(self.pairs, pairs)
+        found = at < len(self.pairs)
+        found[found] = self.pairs[at[found]] == pairs[found]
+        return found
@@ -0,0 +1,95 @@
+from typing import Literal
+import numpy as np
+from torch import Tensor
+from torch.utils.data import Dataset
+from torch.utils.data import get_worker_info
+from torchfm.data._fmdataset import FMDataset
+
+
+class NegativeSampler:
+    def __init__(
+        self,
+        dataset: FMDataset,
+        num_negatives: int = 1,
+        strategy: Literal["uniform", "popularity"] = "uniform",
+        alpha: float = 0.75,
+        max_trials: int = 10,
+        seed: int | list[int] = None
+    ) -> None:
+        """Draw negative items for a batch of users in bulk. Every draw is checked against the
+        interaction index of `dataset` and only the rejected draws are redrawn, up to
+        `max_trials` rounds, so users who interacted with almost every item may keep a few
+        positives among their negatives.
+
+        Args:
+            dataset (FMDataset): Dataset providing the items and the interactions
+            num_negatives (int): Number of negatives per positive
+            strategy (str): Draw items uniformly or proportionally to `count ** alpha`
+            alpha (float): Smoothing exponent of the popularity distribution
+            max_trials (int): Maximum number of redraw rounds
+            seed (int | list[int]): Seed of the random generator, e.g. [seed, rank]
+        """
+        if strategy not in ("uniform", "popularity"):
+            raise ValueError(f"Unknown negative sampling strategy {strategy!r}, use `uniform` or `popularity`.")
+        self._dataset = dataset
+        self._num_items = dataset.num_items
+        self.num_negatives = num_negatives
+        self._max_trials = max_trials
+        self._rng = np.random.default_rng(seed)
+        self._cdf = None
+        if strategy == "popularity":
+            weights = dataset.get_item_counts().astype(np.float64) ** alpha
+            self._cdf = np.cumsum(weights) / weights.sum()
+
+    def seed(self, seed: int | list[int]) -> None:
+        self._rng = np.random.default_rng(seed)
+
+    def _draw(self, size) -> np.ndarray:
+        if self._cdf is None:
+            return self._rng.integers(0, self._num_items, size=size)
+        rows = np.searchsorted(self._cdf, self._rng.random(size=size), side="right")
+        return np.minimum(rows, self._num_items - 1)
+
+    def sample(self, user_rows: np.ndarray) -> np.ndarray:
+        """Returns:
+            np.ndarray: Negative item rows in shape (len(user_rows), num_negatives)
+        """
+        user_rows = np.asarray(user_rows)[:, None]
+        items = self._draw((len(user_rows), self.num_negatives))
+        for _ in range(self._max_trials):
+            rejected = self._dataset.is_interacted(user_rows, items)
+            if not rejected.any():
+                break
+            items[rejected] = self._draw(rejected.sum())
+        return items
+
+
+class PairwiseFMDataset(Dataset):
+    def __init__(self, dataset: FMDataset, sampler: NegativeSampler) -> None:
+        """Serve every interaction of `dataset` as a positive item followed by sampled negative
+        items, for pairwise losses such as `BPRLoss` and `WARPLoss`. Batches must be collated
+        with `data_utils.collate_batch`.
+        """
+        self._dataset = dataset
+        self._sampler = sampler
+        self._worker_id = None
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitems__(self, indices) -> tuple[Tensor, ...]:
+        """Returns:
+            tuple: (u, i) or (u, i, u_offsets, i_offsets) if sparse, in the order expected by
+                `TorchFM.forward`, where `i` holds 1 + num_negatives items per user, the
+                positive first.
+        """
+        # Each DataLoader worker holds a copy of the sampler, reseed it to draw distinct negatives
+        worker = get_worker_info()
+        if worker is not None and worker.id != self._worker_id:
+            self._sampler.seed(worker.seed)
+            self._worker_id = worker.id
+
+        user_rows, item_rows = self._dataset.get_rows(indices)
+        negatives = self._sampler.sample(user_rows)
+        items = np.concatenate([item_rows[:, None], negatives], axis=1)
+        return self._dataset.encode_rows(user_rows, items.ravel())
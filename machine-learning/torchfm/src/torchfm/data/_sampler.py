@@ -0,0 +1,65 @@
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class FMBatchSampler(Sampler[np.ndarray]):
+    def __init__(
+        self,
+        num_samples: int,
+        batch_size: int = 128,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        seed: int = None,
+        num_replicas: int = 1,
+        rank: int = 0
+    ) -> None:
+        """Yield whole batches of interaction indices as NumPy arrays, shuffled with a single
+        permutation per epoch. Paired with `FMDataset.__getitems__`, a `DataLoader` then
+        fetches each batch with one vectorized gather instead of `batch_size` calls.
+
+        With `num_replicas` > 1 every replica draws the same permutation, which requires the
+        same `seed` on every replica, and keeps every `num_replicas`-th sample from `rank` on,
+        like `DistributedSampler`. The permutation is padded so that all replicas run the same
+        number of batches.
+
+        Args:
+            seed (int): Seed of the permutations, drawn at random if None
+            num_replicas (int): Number of processes sharing the samples
+            rank (int): Rank of the current process
+        """
+        self._num_samples = num_samples
+        self._batch_size = batch_size
+        self._shuffle = shuffle
+        self._drop_last = drop_last
+        self._seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self._num_replicas = num_replicas
+        self._rank = rank
+        self._epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """Select the permutation of `epoch`, otherwise every iteration moves to the next one."""
+        self._epoch = epoch
+
+    @property
+    def _replica_size(self) -> int:
+        return -(-self._num_samples // self._num_replicas)
+
+    def __iter__(self):
+        if self._shuffle:
+            order = np.random.default_rng([self._seed, self._epoch]).permutation(self._num_samples)
+        else:
+            order = np.arange(self._num_samples)
+        self._epoch += 1
+
+        if self._num_replicas > 1:
+            order = np.resize(order, self._replica_size * self._num_replicas)
+            order = order[self._rank::self._num_replicas]
+
+        stop = len(self) * self._batch_size
+        for start in range(0, stop, self._batch_size):
+            yield order[start:start + self._batch_size]
+
+    def __len__(self) -> int:
+        if self._drop_last:
+            return self._replica_size // self._batch_size
+        return (self._replica_size + self._batch_size - 1) // self._batch_size
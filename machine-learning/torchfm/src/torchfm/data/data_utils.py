@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 from torch import Tensor
 
@@ -8,4 +9,57 @@ def encode(input: list[str], features: dict[str, int]) -> Tensor:
     encoded = torch.zeros((output_dim), dtype=torch.int8)
     for t in input:
         encoded[features[t]] = 1
-    return encoded
\ No newline at end of file
+    return encoded
+
+def encode_indices(input: list[str], features: dict[str, int]) -> Tensor:
+    """Encode `input` as the sorted feature indices instead of a many-hot vector, so the
+    memory cost depends on the number of active features rather than on `len(features)`.
+    """
+    if len(input) > len(features):
+        raise ValueError("Length of `input` must be less than `features`.")
+    indices = sorted(features[t] for t in input)
+    return torch.tensor(indices, dtype=torch.int64)
+
+def collate_batch(batch: tuple[Tensor, ...]) -> tuple[Tensor, ...]:
+    """Collate function for a `DataLoader` driven by `FMBatchSampler`. The batch is already
+    assembled by `FMDataset.__getitems__`, so there is nothing left to stack.
+    """
+    return tuple(batch)
+
+def csr_gather(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Gather `rows` of a CSR matrix in one vectorized pass.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The concatenated indices of the rows and the offset of
+            each row in it, i.e. the `nn.EmbeddingBag` input layout.
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.zeros(len(rows), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    positions = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(starts - offsets, lengths)
+    return indices[positions], offsets
+
+def to_many_hot(indices: np.ndarray, offsets: np.ndarray, dim: int) -> Tensor:
+    """Scatter an `nn.EmbeddingBag` style input into a dense (B, dim) many-hot tensor."""
+    lengths = np.diff(offsets, append=len(indices))
+    rows = np.repeat(np.arange(len(offsets)), lengths)
+    encoded = torch.zeros((len(offsets), dim), dtype=torch.int8)
+    encoded[torch.from_numpy(rows), torch.from_numpy(indices)] = 1
+    return encoded
+
+def csr_from_pairs(rows: np.ndarray, columns: np.ndarray, num_rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """Build a CSR matrix from (row, column) pairs, sorting the columns of every row and
+    dropping duplicated pairs.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: indptr and indices
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    columns = np.asarray(columns, dtype=np.int64)
+    order = np.lexsort((columns, rows))
+    rows, columns = rows[order], columns[order]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+    indptr = np.searchsorted(rows[keep], np.arange(num_rows + 1))
+    return indptr.astype(np.int64), columns[keep]
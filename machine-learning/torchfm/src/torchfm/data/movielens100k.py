@@ -1,10 +1,18 @@
+import os
+import shutil
+import hashlib
 import requests
 import zipfile
+import numpy as np
 import pandas as pd
 from loguru import logger
 from pathlib import Path
 from tqdm import tqdm
 from torchfm.data._fmdataset import FMDataset
+from torchfm.data.data_utils import csr_from_pairs
+
+# Bump when the processing below changes, to invalidate the cached datasets
+CACHE_VERSION = "2"
 
 
 ZIPCODE_MAPPING = [
@@ -75,81 +83,108 @@ def __download_ml_100k():
     extract_folder = "./__tmp"
     return_path = Path(extract_folder).joinpath(zip_folder)
 
-    if Path(zip_file_path).exists():
+    # The files are written aside then renamed, so concurrent processes, e.g. the ranks of a
+    # distributed job, never see a partial download or extraction
+    if return_path.exists():
         return return_path
 
-    response = requests.get(url, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-    progress_bar = tqdm(
-        total=total_size,
-        unit="B",
-        unit_scale=True,
-        desc=f"Downloading {zip_file_path}")
-    with open(zip_file_path, "wb") as file:
-        with progress_bar:
-            for chunk in response.iter_content(chunk_size=1024):
-                if not chunk: continue
-                file.write(chunk)
-                progress_bar.update(len(chunk))
+    if not Path(zip_file_path).exists():
+        response = requests.get(url, stream=True)
+        response.raise_for_status()
+        total_size = int(response.headers.get('content-length', 0))
+        progress_bar = tqdm(
+            total=total_size,
+            unit="B",
+            unit_scale=True,
+            desc=f"Downloading {zip_file_path}")
+        tmp_zip_path = f"{zip_file_path}.{os.getpid()}.tmp"
+        with open(tmp_zip_path, "wb") as file:
+            with progress_bar:
+                for chunk in response.iter_content(chunk_size=1024):
+                    if not chunk: continue
+                    file.write(chunk)
+                    progress_bar.update(len(chunk))
+        os.replace(tmp_zip_path, zip_file_path)
 
     # Step 2: Unzip the file
+    tmp_folder = Path(extract_folder).joinpath(f".{zip_folder}.{os.getpid()}.tmp")
     with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_folder)
+        zip_ref.extractall(tmp_folder)
+    try:
+        tmp_folder.joinpath(zip_folder).rename(return_path)
+    except OSError:  # Extracted by another process meanwhile
+        pass
+    shutil.rmtree(tmp_folder, ignore_errors=True)
     logger.info(f"Downloaded to {return_path.resolve()}.")
     return return_path
 
 
-def __zipcode_to_state(zipcode: str):
-    for item in ZIPCODE_MAPPING:
-        if (zipcode >= item["zipcode_start"]
-            and zipcode <= item["zipcode_end"]):
-            return "state::" + item["state_code"]
-    return "state::unknown"
-
-
-def __concat_genres(row):
-    items = []
-    for col in row.keys():
-        if not col.startswith("genre::"): continue
-        if int(row[col]) == 1:
-            items.append(col)
-    return items
+def __zipcode_to_state(zipcodes: pd.Series) -> np.ndarray:
+    # The ranges after the "-" placeholder are sorted and disjoint, so the candidate range of
+    # a zipcode is the last one starting before it.
+    starts = np.array([x["zipcode_start"] for x in ZIPCODE_MAPPING[1:]])
+    ends = np.array([x["zipcode_end"] for x in ZIPCODE_MAPPING[1:]])
+    states = np.array(["state::" + x["state_code"] for x in ZIPCODE_MAPPING[1:]], dtype=object)
+    zipcodes = zipcodes.astype(str).to_numpy().astype(str)
+    idx = np.searchsorted(starts, zipcodes, side="right") - 1
+    found = (idx >= 0) & (zipcodes <= ends[idx.clip(0)])
+    result = np.where(found, states[idx.clip(0)], "state::unknown")
+    result[zipcodes == ZIPCODE_MAPPING[0]["zipcode_start"]] = "state::" + ZIPCODE_MAPPING[0]["state_code"]
+    return result
 
 
-def __build_user_features(row):
-    features = [row["gender"], row["occupation"], row["age_group"], row["us_state"]]
-    return features
+def __file_hash(paths: list[Path]) -> str:
+    sha = hashlib.sha256(CACHE_VERSION.encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+    return sha.hexdigest()[:16]
 
 
-def __build_item_features(row):
-    features = [row["year_group"]] + row["genres"]
-    return features
-
+def __compile(
+    ids: np.ndarray,
+    long_features: pd.DataFrame,
+    id_col: str
+) -> tuple[dict, np.ndarray, np.ndarray]:
+    """Build the vocabulary (ids first, then the other features sorted) and the CSR matrix of
+    the entities `ids` from their features in long format (id_col, feature).
+    """
+    names = np.sort(long_features["feature"].unique())
+    vocab = {f: i for i, f in enumerate(ids.tolist() + names.tolist())}
+    rows = np.searchsorted(ids, long_features[id_col].to_numpy())
+    columns = len(ids) + np.searchsorted(names, long_features["feature"].to_numpy())
+    rows = np.concatenate([np.arange(len(ids)), rows])
+    columns = np.concatenate([np.arange(len(ids)), columns])
+    indptr, indices = csr_from_pairs(rows, columns, len(ids))
+    return vocab, indptr, indices
 
-def __extract_features(info: pd.DataFrame, id_col: str):
-    features = info[id_col].unique().tolist()
-    for _, item in info.iterrows():
-        features.extend(item["features"])
-    features = list(set(features))
-    features = {f: i for i, f in enumerate(features)}
-    return features
 
+def load(train: bool=True, disk_cache: bool=True, cache_dir: str="./__tmp/cache", **kwargs) -> FMDataset:
+    """Download and process ml-100k into an FMDataset. The processed dataset is saved under
+    `cache_dir` with a key hashed from the source files, later loads memory-map it.
 
-def load(train: bool=True) -> FMDataset:
-    """Download and process to 3 pd.DataFrames, user_info, item_info and ratings.
+    Args:
+        train (bool): Load the u1.base split, otherwise u1.test
+        disk_cache (bool): Read and write the processed dataset cache
+        cache_dir (str): Directory of the processed dataset cache
+        **kwargs: Forwarded to FMDataset, e.g. its feature cache `use_cache`
     Returns:
-        dict[str, DataFrame]: user_info, item_info, ratings, user_features, item_features
+        FMDataset: The dataset
     """
     
     dir = __download_ml_100k()
-    if train:
-        ratings = pd.read_csv(dir.joinpath("u1.base"), sep="\t", names=[
-            "user_id", "movie_id", "rating", "timestamp"
-        ])
-    else:
-        ratings = pd.read_csv(dir.joinpath("u1.test"), sep="\t", names=[
-            "user_id", "movie_id", "rating", "timestamp"
-        ])
+    ratings_path = dir.joinpath("u1.base" if train else "u1.test")
+    cache_path = Path(cache_dir).joinpath(__file_hash([
+        ratings_path, dir.joinpath("u.user"), dir.joinpath("u.item")
+    ]))
+    if disk_cache and cache_path.joinpath("vocab.json").exists():
+        logger.info(f"Load cached dataset {cache_path}.")
+        return FMDataset.load(cache_path, **kwargs)
+
+    ratings = pd.read_csv(ratings_path, sep="\t", names=[
+        "user_id", "movie_id", "rating", "timestamp"
+    ])
 
     ratings = ratings[["user_id", "movie_id", "rating"]]
 
@@ -168,30 +203,59 @@ def load(train: bool=True) -> FMDataset:
 
     age_bins = [0, 18, 25, 35, 45, 55, 100]
     year_bins = list(range(1920, 2001, 10))
-    user_info["age_group"] = pd.cut(user_info["age"], bins=age_bins, labels=age_bins[:-1])
-    user_info["age_group"] = "age_group::" + user_info["age_group"].astype(str)
-    user_info["us_state"] = user_info["zipcode"].apply(__zipcode_to_state)
+    user_info = user_info.sort_values("user_id")
+    age_groups = pd.cut(user_info["age"], bins=age_bins, labels=age_bins[:-1])
+    # Ages and years outside the bins are NaN, named "nan"
+    user_info["age_group"] = "age_group::" + age_groups.astype(object).fillna("nan").astype(str)
+    user_info["us_state"] = __zipcode_to_state(user_info["zipcode"])
     user_info["gender"] = "gender::" + user_info["gender"]
     user_info["occupation"] = "occupation::" + user_info["occupation"]
-    user_info = user_info.drop(columns=["age", "zipcode"])
-    user_info["features"] = user_info.apply(__build_user_features, axis=1)
-    user_info = user_info[["user_id", "features"]]
+    user_features = user_info.melt(
+        id_vars="user_id",
+        value_vars=["gender", "occupation", "age_group", "us_state"],
+        value_name="feature"
+    )
 
+    item_info = item_info.sort_values("movie_id")
     item_info["year"] = pd.to_datetime(item_info["release_date"]).dt.year
-    item_info["year_group"] = pd.cut(item_info["year"], bins=year_bins, labels=year_bins[:-1])
-    item_info["year_group"] = "year::" + item_info["year_group"].astype(str)
-    item_info = item_info.drop(columns=["movie_title", "release_date", "video_release_date", "idbm"])
-    item_info["genres"] = item_info.apply(__concat_genres, axis=1)
-    ignore_cols = [x for x in item_info.columns if x.startswith("genre::")]
-    item_info = item_info.drop(columns=ignore_cols)
-    item_info["features"] = item_info.apply(__build_item_features, axis=1)
-    item_info = item_info[["movie_id", "features"]]
-
-    dataset = FMDataset(
-        interactions=[tuple(row) for row in ratings.itertuples(index=False, name=None)],
-        user_info=[tuple(row) for row in user_info.itertuples(index=False, name=None)],
-        item_info=[tuple(row) for row in item_info.itertuples(index=False, name=None)],
-        user_features=__extract_features(user_info, "user_id"),
-        item_features=__extract_features(item_info, "movie_id")
+    year_groups = pd.cut(item_info["year"], bins=year_bins, labels=year_bins[:-1])
+    item_info["year_group"] = "year::" + year_groups.astype(object).fillna("nan").astype(str)
+    genres = item_info.melt(
+        id_vars="movie_id",
+        value_vars=[x for x in item_info.columns if x.startswith("genre::")],
+        var_name="feature"
+    )
+    genres = genres[genres["value"] == 1]
+    years = item_info[["movie_id", "year_group"]].rename(columns={"year_group": "feature"})
+    item_features = pd.concat([years, genres[["movie_id", "feature"]]])
+
+    user_ids = user_info["user_id"].to_numpy(dtype=np.int64)
+    item_ids = item_info["movie_id"].to_numpy(dtype=np.int64)
+    user_vocab, user_indptr, user_indices = __compile(user_ids, user_features, "user_id")
+    item_vocab, item_indptr, item_indices = __compile(item_ids, item_features, "movie_id")
+
+    dataset = FMDataset.from_arrays(
+        {
+            "user_ids": user_ids,
+            "user_indptr": user_indptr,
+            "user_indices": user_indices,
+            "item_ids": item_ids,
+            "item_indptr": item_indptr,
+            "item_indices": item_indices,
+            "user_rows": np.searchsorted(user_ids, ratings["user_id"].to_numpy()),
+            "item_rows": np.searchsorted(item_ids, ratings["movie_id"].to_numpy()),
+            "ratings": ratings["rating"].to_numpy(dtype=np.float32)
+        },
+        user_features=user_vocab,
+        item_features=item_vocab,
+        **kwargs
     )
+    if disk_cache:
+        # Write aside then rename, so concurrent jobs never read a partial cache
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        dataset.save(tmp_path)
+        try:
+            tmp_path.rename(cache_path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
     return dataset
\ No newline at end of file
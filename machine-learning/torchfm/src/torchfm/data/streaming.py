@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+from loguru import logger
+from pathlib import Path
+from typing import Iterator
+from torchfm.data._fmdataset import FMDataset
+from torchfm.data._fmdataset import write_arrays
+from torchfm.data._fmdataset import write_vocab
+from torchfm.data._index import InteractionIndex
+from torchfm.data.data_utils import csr_from_pairs
+
+
+def __read_chunks(
+    path: Path,
+    columns: list[str] | None,
+    chunksize: int,
+    dtype: type | None = None
+) -> Iterator[pd.DataFrame]:
+    """Stream a CSV or Parquet file as DataFrames of at most `chunksize` rows. The `dtype` of
+    CSV columns is inferred per chunk unless given.
+    """
+    if path.suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading Parquet files requires `pyarrow`.") from e
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=dtype)
+
+
+def __compile_info(
+    path: Path,
+    id_col: str,
+    feature_cols: list[str] | None,
+    chunksize: int
+) -> tuple[dict, np.ndarray, np.ndarray, np.ndarray]:
+    """Read an info file in one pass. Every non-null value of a feature column becomes the
+    feature `"{column}::{value}"`, numbered in order of first appearance after the ids.
+
+    Returns:
+        tuple: vocabulary, sorted ids, CSR indptr and indices
+    """
+    columns = None if feature_cols is None else [id_col] + feature_cols
+    codes: dict[str, int] = {}
+    ids, rows, features = [], [], []
+    # Read CSV values as text, so a value is named the same whatever the chunk it is in
+    for chunk in __read_chunks(path, columns, chunksize, dtype=str):
+        long = chunk.melt(id_vars=id_col, var_name="column", value_name="value").dropna()
+        names = long["column"].astype(str) + "::" + long["value"].astype(str)
+        for name in names.unique():
+            codes.setdefault(name, len(codes))
+        ids.append(chunk[id_col].to_numpy(dtype=np.int64))
+        rows.append(long[id_col].to_numpy(dtype=np.int64))
+        features.append(names.map(codes).to_numpy(dtype=np.int64))
+
+    ids = np.unique(np.concatenate(ids))
+    rows = np.searchsorted(ids, np.concatenate(rows))
+    features = len(ids) + np.concatenate(features)
+    # Every entity has its own id as a feature
+    rows = np.concatenate([np.arange(len(ids)), rows])
+    features = np.concatenate([np.arange(len(ids)), features])
+    indptr, indices = csr_from_pairs(rows, features, len(ids))
+
+    vocab = {id: i for i, id in enumerate(ids.tolist())}
+    vocab.update({name: len(ids) + code for name, code in codes.items()})
+    return vocab, ids, indptr, indices
+
+
+def __to_npy(raw_path: Path, dtype: type, length: int, chunksize: int) -> None:
+    """Convert a raw binary column into a .npy file, copying `chunksize` values at a time."""
+    raw = np.memmap(raw_path, dtype=dtype, mode="r", shape=(length,)) if length > 0 else []
+    out = np.lib.format.open_memmap(raw_path.with_suffix(".npy"), mode="w+", dtype=dtype, shape=(length,))
+    for start in range(0, length, chunksize):
+        out[start:start + chunksize] = raw[start:start + chunksize]
+    out.flush()
+    del raw, out
+    raw_path.unlink()
+
+
+def build(
+    interactions_path: str | Path,
+    user_info_path: str | Path,
+    item_info_path: str | Path,
+    output_dir: str | Path,
+    user_id_col: str = "user_id",
+    item_id_col: str = "item_id",
+    rating_col: str | None = "rating",
+    user_feature_cols: list[str] | None = None,
+    item_feature_cols: list[str] | None = None,
+    chunksize: int = 1_000_000
+) -> Path:
+    """Compile CSV or Parquet files into the on-disk layout of `FMDataset.save`.
+
+    The info files are read once to build the vocabularies and the feature CSR matrices. The
+    interactions are then streamed `chunksize` rows at a time and appended to raw columns on
+    disk, so they are never held in memory as Python objects. The interaction indexes are
+    built from those columns out of core too, see `InteractionIndex.build_on_disk`.
+
+    Args:
+        interactions_path (str | Path): Interactions with user id, item id and rating columns
+        user_info_path (str | Path): Users with an id column and categorical feature columns
+        item_info_path (str | Path): Items with an id column and categorical feature columns
+        output_dir (str | Path): Directory of the compiled dataset
+        user_id_col (str): Name of the user id column
+        item_id_col (str): Name of the item id column
+        rating_col (str | None): Name of the rating column, None for implicit feedback where
+            every interaction is rated 1
+        user_feature_cols (list[str] | None): Feature columns of the users, default all
+        item_feature_cols (list[str] | None): Feature columns of the items, default all
+        chunksize (int): Number of rows read at once
+    Returns:
+        Path: The output directory, to be read with `load`
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    user_vocab, user_ids, user_indptr, user_indices = __compile_info(
+        Path(user_info_path), user_id_col, user_feature_cols, chunksize)
+    item_vocab, item_ids, item_indptr, item_indices = __compile_info(
+        Path(item_info_path), item_id_col, item_feature_cols, chunksize)
+    logger.info(f"Compiled {len(user_ids)} users and {len(item_ids)} items.")
+
+    columns = [user_id_col, item_id_col] + ([rating_col] if rating_col is not None else [])
+    raw = {
+        "user_rows": (output_dir.joinpath("user_rows.bin"), np.int64),
+        "item_rows": (output_dir.joinpath("item_rows.bin"), np.int64),
+        "ratings": (output_dir.joinpath("ratings.bin"), np.float32)
+    }
+    files = {name: open(path, "wb") for name, (path, _) in raw.items()}
+    length = 0
+    try:
+        for chunk in __read_chunks(Path(interactions_path), columns, chunksize):
+            user_rows = FMDataset._find_rows(user_ids, chunk[user_id_col].to_numpy(dtype=np.int64), "User")
+            item_rows = FMDataset._find_rows(item_ids, chunk[item_id_col].to_numpy(dtype=np.int64), "Item")
+            if rating_col is None:
+                ratings = np.ones(len(chunk), dtype=np.float32)
+            else:
+                ratings = chunk[rating_col].to_numpy(dtype=np.float32)
+            files["user_rows"].write(user_rows.astype(np.int64).tobytes())
+            files["item_rows"].write(item_rows.astype(np.int64).tobytes())
+            files["ratings"].write(ratings.tobytes())
+            length += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+
+    for path, dtype in raw.values():
+        __to_npy(path, dtype, length, chunksize)
+    logger.info(f"Compiled {length} interactions.")
+
+    user_rows = np.load(output_dir.joinpath("user_rows.npy"), mmap_mode="r")
+    item_rows = np.load(output_dir.joinpath("item_rows.npy"), mmap_mode="r")
+    arrays = {
+        "user_ids": user_ids,
+        "user_indptr": user_indptr,
+        "user_indices": user_indices,
+        "item_ids": item_ids,
+        "item_indptr": item_indptr,
+        "item_indices": item_indices
+    }
+    write_arrays(output_dir, arrays)
+    InteractionIndex.build_on_disk(
+        user_rows, item_rows, len(user_ids), len(item_ids), output_dir, "user", chunksize)
+    InteractionIndex.build_on_disk(
+        item_rows, user_rows, len(item_ids), len(user_ids), output_dir, "item", chunksize)
+    write_vocab(output_dir, user_vocab, item_vocab)
+    return output_dir
+
+
+def load(path: str | Path, **kwargs) -> FMDataset:
+    """Memory-map a dataset compiled by `build`.
+
+    Args:
+        path (str | Path): Output directory of `build`
+        **kwargs: Forwarded to FMDataset
+    """
+    return FMDataset.load(path, mmap=True, **kwargs)
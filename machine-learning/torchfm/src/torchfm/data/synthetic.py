@@ -0,0 +1,100 @@
+import numpy as np
+from torchfm.data._fmdataset import FMDataset
+from torchfm.data.data_utils import csr_from_pairs
+
+
+def __features(
+    rng: np.random.Generator,
+    num_rows: int,
+    num_features: int,
+    features_per_row: int,
+    prefix: str
+) -> tuple[dict, np.ndarray, np.ndarray, np.ndarray]:
+    """Give every entity `features_per_row` distinct features drawn uniformly out of
+    `num_features`. The vocabulary holds the ids first, then the features `"{prefix}::{j}"`.
+    """
+    ids = np.arange(num_rows, dtype=np.int64)
+    k = min(features_per_row, num_features)
+    if k > 0:
+        columns = np.argpartition(rng.random((num_rows, num_features)), k - 1, axis=1)[:, :k]
+    else:
+        columns = np.zeros((num_rows, 0), dtype=np.int64)
+    rows = np.concatenate([ids, np.repeat(ids, k)])
+    columns = np.concatenate([ids, num_rows + columns.ravel()])
+    indptr, indices = csr_from_pairs(rows, columns, num_rows)
+    vocab = {id: id for id in ids.tolist()}
+    vocab.update({f"{prefix}::{j}": num_rows + j for j in range(num_features)})
+    return vocab, ids, indptr, indices
+
+
+def load(
+    num_users: int = 1000,
+    num_items: int = 500,
+    num_user_features: int = 20,
+    num_item_features: int = 20,
+    user_features_per_row: int = 3,
+    item_features_per_row: int = 3,
+    density: float = 0.01,
+    popularity_skew: float = 1.0,
+    implicit: bool = False,
+    seed: int = 0,
+    **kwargs
+) -> FMDataset:
+    """Generate a random dataset, for benchmarks and tests that must run offline.
+
+    Users interact uniformly while items are drawn from a Zipf-like popularity law, so a few
+    items are interacted far more than the others as in real catalogs. The same arguments
+    always generate the same dataset.
+
+    Args:
+        num_users (int): Number of users
+        num_items (int): Number of items
+        num_user_features (int): Number of user features besides the ids
+        num_item_features (int): Number of item features besides the ids
+        user_features_per_row (int): Features of every user besides its id
+        item_features_per_row (int): Features of every item besides its id
+        density (float): Fraction of the user-item pairs interacted, duplicates are dropped
+            so the actual density is slightly lower
+        popularity_skew (float): Exponent of the item popularity, 0 for uniform
+        implicit (bool): Rate every interaction 1, otherwise 1 to 5
+        seed (int): Seed of the generator
+        **kwargs: Forwarded to FMDataset
+    Returns:
+        FMDataset: The dataset
+    """
+    rng = np.random.default_rng(seed)
+    user_vocab, user_ids, user_indptr, user_indices = __features(
+        rng, num_users, num_user_features, user_features_per_row, "user_feature")
+    item_vocab, item_ids, item_indptr, item_indices = __features(
+        rng, num_items, num_item_features, item_features_per_row, "item_feature")
+
+    num_interactions = int(round(density * num_users * num_items))
+    popularity = 1.0 / np.arange(1, num_items + 1) ** popularity_skew
+    # Popular items are spread over the ids rather than being the smallest ones
+    popularity = rng.permutation(popularity / popularity.sum())
+    user_rows = rng.integers(0, num_users, num_interactions)
+    item_rows = rng.choice(num_items, num_interactions, p=popularity)
+    _, first = np.unique(user_rows * num_items + item_rows, return_index=True)
+    first = np.sort(first)
+    user_rows, item_rows = user_rows[first], item_rows[first]
+    if implicit:
+        ratings = np.ones(len(user_rows), dtype=np.float32)
+    else:
+        ratings = rng.integers(1, 6, len(user_rows)).astype(np.float32)
+
+    return FMDataset.from_arrays(
+        {
+            "user_ids": user_ids,
+            "user_indptr": user_indptr,
+            "user_indices": user_indices,
+            "item_ids": item_ids,
+            "item_indptr": item_indptr,
+            "item_indices": item_indices,
+            "user_rows": user_rows,
+            "item_rows": item_rows,
+            "ratings": ratings
+        },
+        user_features=user_vocab,
+        item_features=item_vocab,
+        **kwargs
+    )
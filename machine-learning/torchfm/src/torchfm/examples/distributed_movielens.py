@@ -0,0 +1,37 @@
+"""Data-parallel training on CPU processes, launch with e.g.
+
+    torchrun --nproc_per_node=4 distributed_movielens.py
+
+or across hosts with `--nnodes`, `--node_rank` and `--rdzv_endpoint`. torchrun sets
+OMP_NUM_THREADS=1 per process when starting several, so each process uses one core.
+"""
+import os
+import torch.distributed as dist
+from torchfm.data import movielens100k
+from torchfm.model import ModelTrainer
+from torchfm.model import TorchFM
+
+
+if __name__ == "__main__":
+    dist.init_process_group(backend="gloo")
+    # One process per host downloads and caches the dataset, the others then read the cache
+    if int(os.environ.get("LOCAL_RANK", 0)) == 0:
+        movielens100k.load(train=True)
+        movielens100k.load(train=False)
+    dist.barrier()
+    train = movielens100k.load(train=True, sparse=True)
+    model = TorchFM(train.user_input_dim, train.item_input_dim)
+    trainer = ModelTrainer(
+        model,
+        dataset=train,
+        learning_rate=1e-3,
+        distributed=True,
+        gradient_accumulation_steps=2,
+        checkpoint_dir="./__tmp/checkpoints"
+    )
+    trainer.train(num_epochs=5)
+
+    if dist.get_rank() == 0:
+        test = movielens100k.load(train=False)
+        print(trainer.evaluate(test, metrics=["mse", "auc", "precision@k"]))
+    dist.destroy_process_group()
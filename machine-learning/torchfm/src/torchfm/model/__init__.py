@@ -1,2 +1,8 @@
 from torchfm.model._torchfm import TorchFM
-from torchfm.model._trainer import ModelTrainer
\ No newline at end of file
+from torchfm.model._trainer import ModelTrainer
+from torchfm.model._callbacks import Callback
+from torchfm.model._callbacks import MetricsSink
+from torchfm.model._callbacks import JSONLSink
+from torchfm.model._callbacks import CSVSink
+from torchfm.model._callbacks import MetricsLogger
+from torchfm.model._callbacks import ProfilerCallback
\ No newline at end of file
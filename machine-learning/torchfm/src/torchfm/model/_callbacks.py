@@ -0,0 +1,184 @@
+import csv
+import json
+import torch
+import torch.distributed as dist
+from abc import ABC
+from abc import abstractmethod
+from pathlib import Path
+from loguru import logger
+from torch.profiler import ProfilerActivity
+from torch.profiler import profile
+from torch.profiler import schedule
+
+
+class Callback:
+    """Hooks called by `ModelTrainer.train`, all of them no-ops by default.
+
+    The batch logs hold the `loss`, the number of `samples` and the seconds spent in each
+    phase: `data_time` waiting for the loader, `forward_time`, `backward_time` and `step_time`.
+    The epoch logs add the totals of the epoch, its `samples_per_sec`, `peak_rss_mb` the largest
+    resident set size sampled at the end of its batches, and `process_peak_rss_mb` the
+    high-water mark of the process since it started.
+    """
+    def on_train_begin(self, trainer) -> None:
+        pass
+
+    def on_epoch_begin(self, trainer, epoch: int) -> None:
+        pass
+
+    def on_batch_end(self, trainer, batch_idx: int, logs: dict) -> None:
+        pass
+
+    def on_epoch_end(self, trainer, epoch: int, logs: dict) -> None:
+        pass
+
+    def on_train_end(self, trainer, logs: dict) -> None:
+        pass
+
+
+class MetricsSink(ABC):
+    """Destination of flat metric records."""
+    @abstractmethod
+    def write(self, record: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JSONLSink(MetricsSink):
+    def __init__(self, path: str | Path) -> None:
+        """Append every record to `path` as a line of JSON."""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a")
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class CSVSink(MetricsSink):
+    def __init__(self, path: str | Path) -> None:
+        """Write the records to `path` as CSV rows. The columns are the keys of the first
+        record, the keys missing from it are dropped from the later ones.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w", newline="")
+        self._writer = None
+
+    def write(self, record: dict) -> None:
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=list(record), extrasaction="ignore")
+            self._writer.writeheader()
+        self._writer.writerow(record)
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class MetricsLogger(Callback):
+    def __init__(
+        self,
+        sink: MetricsSink,
+        batch_sink: MetricsSink = None,
+        log_every: int = 1,
+        close: bool = True
+    ) -> None:
+        """Send the epoch logs to a sink.
+
+        Args:
+            sink (MetricsSink): Receives one record per epoch
+            batch_sink (MetricsSink): Receives one record every `log_every` batches, if given
+            log_every (int): Interval of the batch records
+            close (bool): Close the sinks at the end of the training
+        """
+        self.sink = sink
+        self.batch_sink = batch_sink
+        self.log_every = log_every
+        self.close = close
+        self._epoch = 0
+
+    def on_epoch_begin(self, trainer, epoch: int) -> None:
+        self._epoch = epoch
+
+    def on_batch_end(self, trainer, batch_idx: int, logs: dict) -> None:
+        if self.batch_sink is not None and (batch_idx + 1) % self.log_every == 0:
+            self.batch_sink.write({"epoch": self._epoch, "batch": batch_idx, **logs})
+
+    def on_epoch_end(self, trainer, epoch: int, logs: dict) -> None:
+        self.sink.write(logs)
+
+    def on_train_end(self, trainer, logs: dict) -> None:
+        if self.close:
+            self.sink.close()
+            if self.batch_sink is not None:
+                self.batch_sink.close()
+
+
+class ProfilerCallback(Callback):
+    def __init__(
+        self,
+        output_dir: str | Path,
+        epoch: int = 0,
+        wait: int = 1,
+        warmup: int = 1,
+        active: int = 5,
+        record_shapes: bool = False,
+        profile_memory: bool = False
+    ) -> None:
+        """Capture a window of batches with `torch.profiler`.
+
+        The batches of `epoch` are skipped `wait` times, profiled without recording `warmup`
+        times, then recorded `active` times. The trace is exported to `output_dir` for
+        chrome://tracing or Perfetto, next to a table of the most expensive operators.
+
+        Args:
+            output_dir (str | Path): Directory of the traces
+            epoch (int): Epoch to profile, counted from the first epoch of the trainer
+        """
+        self.output_dir = Path(output_dir)
+        self.epoch = epoch
+        self.schedule = schedule(wait=wait, warmup=warmup, active=active, repeat=1)
+        self.record_shapes = record_shapes
+        self.profile_memory = profile_memory
+        self._profiler = None
+
+    def _export(self, profiler: profile) -> None:
+        rank = dist.get_rank() if dist.is_initialized() else 0
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        name = f"trace_epoch{self.epoch}_rank{rank}"
+        profiler.export_chrome_trace(str(self.output_dir.joinpath(f"{name}.json")))
+        table = profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=25)
+        self.output_dir.joinpath(f"{name}.txt").write_text(table)
+        logger.info(f"Saved profiler trace to {self.output_dir.joinpath(name)}.json")
+
+    def on_epoch_begin(self, trainer, epoch: int) -> None:
+        if epoch != self.epoch:
+            return
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self._profiler = profile(
+            activities=activities,
+            schedule=self.schedule,
+            on_trace_ready=self._export,
+            record_shapes=self.record_shapes,
+            profile_memory=self.profile_memory
+        )
+        self._profiler.start()
+
+    def on_batch_end(self, trainer, batch_idx: int, logs: dict) -> None:
+        if self._profiler is not None:
+            self._profiler.step()
+
+    def on_epoch_end(self, trainer, epoch: int, logs: dict) -> None:
+        if self._profiler is not None:
+            # Exports the window if the epoch ended before it did
+            self._profiler.stop()
+            self._profiler = None
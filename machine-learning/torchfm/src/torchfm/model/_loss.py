@@ -8,20 +8,45 @@ class BPRLoss(nn.Module):
 
     def forward(self, pos_scores, neg_scores):
         # pos_scores: Predicted scores for positive items (shape: [batch_size])
-        # neg_scores: Predicted scores for negative items (shape: [batch_size])
-        loss = -torch.mean(torch.log(torch.sigmoid(pos_scores - neg_scores)))
+        # neg_scores: Predicted scores for negative items (shape: [batch_size] or [batch_size, num_negatives])
+        if neg_scores.dim() == 2:
+            pos_scores = pos_scores.unsqueeze(1)
+        # -log(sigmoid(x)) computed as -logsigmoid(x) does not underflow for large negative x
+        loss = -torch.mean(F.logsigmoid(pos_scores - neg_scores))
         return loss
 
 class WARPLoss(nn.Module):
-    def __init__(self):
+    def __init__(self, num_items: int = None, margin: float = 1.0):
+        """Weighted Approximate-Rank Pairwise loss.
+
+        For every positive, the sampled negatives are scanned in order as if they were drawn one
+        by one until one violates the margin. If the first violator is found after `n` trials,
+        the rank of the positive is estimated as `(num_items - 1) // n`, and the pairwise loss
+        against that violator is weighted by `log(1 + rank)`, so positives ranked low get larger
+        updates. Positives without any violator contribute nothing.
+
+        Args:
+            num_items (int): Size of the catalog the negatives are drawn from, defaults to the
+                number of sampled negatives + 1
+            margin (float): Margin a negative has to come within to be a violator
+        """
         super(WARPLoss, self).__init__()
+        self._num_items = num_items
+        self._margin = margin
 
     def forward(self, pos_scores, neg_scores):
         # pos_scores: Predicted scores for positive items (shape: [batch_size])
         # neg_scores: Predicted scores for negative items (shape: [batch_size, num_negatives])
-        loss = 0.0
-        for i in range(neg_scores.size(1)):  # Iterate through negative items
-            neg_score = neg_scores[:, i]  # Get score of the current negative item
-            loss += torch.mean(torch.log(1 + torch.exp(neg_score - pos_scores)))
+        if neg_scores.dim() == 1:
+            neg_scores = neg_scores.unsqueeze(1)
+        num_items = self._num_items or neg_scores.size(1) + 1
 
-        return loss
\ No newline at end of file
+        violations = neg_scores - pos_scores.unsqueeze(1) + self._margin > 0
+        found = violations.any(dim=1)
+        first = violations.to(torch.int8).argmax(dim=1) # Index of the first violator
+        rank = torch.div(num_items - 1, first + 1, rounding_mode="floor")
+        weights = torch.log1p(rank.to(pos_scores.dtype)) * found
+
+        violator_scores = neg_scores.gather(1, first.unsqueeze(1)).squeeze(1)
+        loss = torch.mean(weights * F.softplus(violator_scores - pos_scores))
+        return loss
@@ -0,0 +1,24 @@
+from torch.optim import Optimizer
+
+
+class MultiOptimizer:
+    def __init__(self, optimizers: list[Optimizer]) -> None:
+        """Drive several optimizers over disjoint parameter groups as one, e.g. `SparseAdam` for
+        the embedding tables with `Adam` for the dense parameters.
+        """
+        self.optimizers = optimizers
+
+    def zero_grad(self, set_to_none: bool = True) -> None:
+        for optimizer in self.optimizers:
+            optimizer.zero_grad(set_to_none=set_to_none)
+
+    def step(self) -> None:
+        for optimizer in self.optimizers:
+            optimizer.step()
+
+    def state_dict(self) -> dict:
+        return {"optimizers": [optimizer.state_dict() for optimizer in self.optimizers]}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        for optimizer, state in zip(self.optimizers, state_dict["optimizers"]):
+            optimizer.load_state_dict(state)
@@ -2,49 +2,152 @@ import torch
 from loguru import logger
 from torch import Tensor
 from torch import FloatTensor
+from torch import LongTensor
 from torch import nn
+from torch.nn import functional as F
 
 class TorchFM(nn.Module):
     def __init__(
         self,
         user_input_dim: int,
         item_input_dim: int,
-        embedding_dim: int = 8
+        embedding_dim: int = 8,
+        sparse: bool = False
     ):
+        """
+        Args:
+            sparse (bool): Produce sparse gradients for the embedding and bias tables, holding
+                only the rows of the features in the batch. They require an optimizer
+                supporting sparse gradients, such as `SparseAdam` or `Adagrad`.
+        """
         super().__init__()
-        self._user_embeddings = nn.Linear(user_input_dim, embedding_dim)
-        self._item_embeddings = nn.Linear(item_input_dim, embedding_dim)
-        self._user_biases = nn.Linear(user_input_dim, 1)
-        self._item_biases = nn.Linear(item_input_dim, 1)
+        self.sparse = sparse
+        self._user_embeddings = nn.EmbeddingBag(user_input_dim, embedding_dim, mode="sum", sparse=sparse)
+        self._item_embeddings = nn.EmbeddingBag(item_input_dim, embedding_dim, mode="sum", sparse=sparse)
+        self._user_biases = nn.EmbeddingBag(user_input_dim, 1, mode="sum", sparse=sparse)
+        self._item_biases = nn.EmbeddingBag(item_input_dim, 1, mode="sum", sparse=sparse)
+        self._bias = nn.Parameter(torch.zeros(1))
+        nn.init.normal_(self._user_embeddings.weight, std=1 / embedding_dim)
+        nn.init.normal_(self._item_embeddings.weight, std=1 / embedding_dim)
+        nn.init.zeros_(self._user_biases.weight)
+        nn.init.zeros_(self._item_biases.weight)
 
-    def forward(self, u: Tensor, i: Tensor, verbose: bool=False) -> Tensor:
-        """Process in batch of size B, the tensor `u` represents the many-hot encoded features of 
-        users and the tensor `i` represents the many-hot encoded features of items. The function
-        takes these inputs and compute scores for B pairs.
+    @staticmethod
+    def _to_bags(x: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+        """Convert a dense many-hot tensor of shape (B, F) into the indices, offsets and weights
+        of its non-zero entries.
+        """
+        if len(x.shape) == 1:
+            x = x.reshape(1, -1)
+        rows, indices = x.nonzero(as_tuple=True)
+        offsets = torch.zeros(x.shape[0], dtype=torch.int64)
+        offsets[1:] = torch.bincount(rows, minlength=x.shape[0])[:-1].cumsum(0)
+        return indices, offsets, x[rows, indices].to(torch.float32)
+
+    def _lookup(self, table: nn.EmbeddingBag, x: Tensor, offsets: Tensor = None) -> Tensor:
+        """Sum the rows of `table` selected by `x`. When `offsets` is given, `x` is a flat
+        tensor of feature indices and `offsets` marks where each sample starts, exactly as
+        `nn.EmbeddingBag` expects. Otherwise `x` is a dense many-hot tensor of shape (B, F).
+        """
+        if offsets is not None:
+            return table(x, offsets)
+
+        if self.sparse:
+            # A matrix product would produce a dense gradient for the whole table
+            indices, offsets, weights = self._to_bags(x)
+            return table(indices, offsets, per_sample_weights=weights)
+
+        if x.dtype != torch.float32:
+            x = x.to(torch.float32)
+
+        if len(x.shape) == 1:
+            x = x.reshape(1, -1)
+        return x @ table.weight
+
+    def l2_penalty(
+        self,
+        u: Tensor,
+        i: Tensor,
+        u_offsets: LongTensor = None,
+        i_offsets: LongTensor = None
+    ) -> Tensor:
+        """Squared L2 norm of the table rows used by a batch, given in the same layout as
+        `forward`. Adding it to the loss applies weight decay lazily, to the touched rows only,
+        which keeps the gradients sparse.
+        """
+        if u_offsets is None:
+            u = self._to_bags(u)[0]
+        if i_offsets is None:
+            i = self._to_bags(i)[0]
+        u, i = torch.unique(u), torch.unique(i)
+        penalty = self._bias.pow(2).sum()
+        for table, x in (
+            (self._user_embeddings, u), (self._user_biases, u),
+            (self._item_embeddings, i), (self._item_biases, i)
+        ):
+            penalty = penalty + F.embedding(x, table.weight, sparse=self.sparse).pow(2).sum()
+        return penalty
+
+    def user_representations(self, u: Tensor, u_offsets: LongTensor = None) -> tuple[Tensor, Tensor]:
+        """Returns:
+            tuple[Tensor, Tensor]: User embeddings in shape (B, K) and biases in shape (B, )
+        """
+        u_emb = self._lookup(self._user_embeddings, u, u_offsets) # Output (B, K)
+        u_bias = self._lookup(self._user_biases, u, u_offsets).squeeze(1) # Output (B, )
+        return u_emb, u_bias
+
+    def item_representations(self, i: Tensor, i_offsets: LongTensor = None) -> tuple[Tensor, Tensor]:
+        """Returns:
+            tuple[Tensor, Tensor]: Item embeddings in shape (B, K) and biases in shape (B, )
+        """
+        i_emb = self._lookup(self._item_embeddings, i, i_offsets) # Output (B, K)
+        i_bias = self._lookup(self._item_biases, i, i_offsets).squeeze(1) # Output (B, )
+        return i_emb, i_bias
+
+    def score_all(
+        self,
+        u_emb: Tensor,
+        u_bias: Tensor,
+        i_emb: Tensor,
+        i_bias: Tensor
+    ) -> Tensor:
+        """Score every user against every item from precomputed representations.
 
-        Args:
-            u (Tensor): User inputs, should be in shape (B, U)
-            i (Tensor): Item inputs, should be in shape (B, I)
         Returns:
-            Tensor: Output in shape (B, 1)
+            Tensor: Output in shape (B, N) for B users and N items
         """
+        return u_emb @ i_emb.T + u_bias[:, None] + i_bias[None, :] + self._bias
 
-        if u.dtype != torch.float32:
-            u = u.to(torch.float32)
-        
-        if i.dtype != torch.float32:
-            i = i.to(torch.float32)
+    def forward(
+        self,
+        u: Tensor,
+        i: Tensor,
+        u_offsets: LongTensor = None,
+        i_offsets: LongTensor = None,
+        verbose: bool=False
+    ) -> Tensor:
+        """Process in batch of size B, the tensor `u` represents the features of users and the 
+        tensor `i` represents the features of items. The function takes these inputs and compute
+        scores for B pairs.
 
-        if len(u.shape) == 1:
-            u = u.reshape(1, -1)
+        The features can be passed in two layouts:
+        - Dense: many-hot encoded tensors, `u` in shape (B, U) and `i` in shape (B, I).
+        - Sparse: flat feature indices with offsets like `nn.EmbeddingBag`, `u` in shape (Nu, )
+          with `u_offsets` in shape (B, ) and `i` in shape (Ni, ) with `i_offsets` in shape (B, ).
 
-        if len(i.shape) == 1:
-            i = i.reshape(1, -1)
+        The items may also hold M = B * m items, m consecutive items per user, e.g. a positive
+        followed by sampled negatives. Each user is then scored against its own m items.
 
-        u_emb = self._user_embeddings(u) # Output (B, K)
-        i_emb = self._item_embeddings(i) # Output (B, K)
-        u_bias = self._user_biases(u).squeeze(1) # Output (B, )
-        i_bias = self._item_biases(i).squeeze(1) # Output (B, )
+        Args:
+            u (Tensor): User inputs
+            i (Tensor): Item inputs
+            u_offsets (LongTensor, optional): Start position of each user in `u` (sparse only)
+            i_offsets (LongTensor, optional): Start position of each item in `i` (sparse only)
+        Returns:
+            Tensor: Output in shape (B, ) or (B, m) for m items per user
+        """
+        u_emb, u_bias = self.user_representations(u, u_offsets)
+        i_emb, i_bias = self.item_representations(i, i_offsets)
 
         if verbose:
             logger.info((
@@ -54,8 +157,15 @@ class TorchFM(nn.Module):
                 f"User biases: {u_bias.shape}\n"
                 f"Item biases: {i_bias.shape}."
             ))
+        if i_emb.shape[0] != u_emb.shape[0]:
+            m = i_emb.shape[0] // u_emb.shape[0]
+            i_emb = i_emb.reshape(-1, m, i_emb.shape[1]) # Output (B, m, K)
+            i_bias = i_bias.reshape(-1, m) # Output (B, m)
+            scores = (u_emb.unsqueeze(1) * i_emb).sum(axis=2)
+            return scores + u_bias.unsqueeze(1) + i_bias + self._bias
+
         scores = (u_emb * i_emb).sum(axis=1)
-        scores = scores + u_bias + i_bias
+        scores = scores + u_bias + i_bias + self._bias
         return scores
 
 if __name__ == "__main__":
@@ -76,11 +186,18 @@ if __name__ == "__main__":
         [0, 0, 1]
     ])
 
-    scores = model.forward(u, i, True)
+    scores = model.forward(u, i, verbose=True)
     print(f"Model compute: {scores[0]:.4f}")
-    u_emb = model._user_embeddings(u[0])
-    i_emb = model._item_embeddings(i[0])
-    u_bias = model._user_biases(u[0])
-    i_bias = model._item_biases(i[0])
-    score = u_emb.dot(i_emb) + u_bias + i_bias
-    print(f"Manual compute: {score.item():.4f}")
\ No newline at end of file
+    u_emb = model._user_embeddings.weight[0]
+    i_emb = model._item_embeddings.weight[0]
+    u_bias = model._user_biases.weight[0]
+    i_bias = model._item_biases.weight[0]
+    score = u_emb.dot(i_emb) + u_bias + i_bias + model._bias
+    print(f"Manual compute: {score.item():.4f}")
+
+    u_idx = LongTensor([0, 1, 0, 1])
+    u_offsets = LongTensor([0, 1, 2])
+    i_idx = LongTensor([0, 0, 1, 2])
+    i_offsets = LongTensor([0, 1, 3])
+    sparse_scores = model.forward(u_idx, i_idx, u_offsets, i_offsets)
+    print(f"Sparse compute: {sparse_scores[0]:.4f}")
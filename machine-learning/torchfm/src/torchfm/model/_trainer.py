@@ -1,12 +1,49 @@
 import time
+import torch
+import numpy as np
+import torch.distributed as dist
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from typing import Literal
 from loguru import logger
 from tqdm import tqdm
 from torch.optim import Adam
+from torch.optim import Adagrad
+from torch.optim import SparseAdam
 from torch.nn import MSELoss
+from torch.nn.parallel import DistributedDataParallel
+from torch.profiler import record_function
 from torch.utils.data import DataLoader
+from torchfm._memory import process_peak_rss_mb
+from torchfm._memory import rss_mb
 from torchfm.model._torchfm import TorchFM
+from torchfm.model._callbacks import Callback
+from torchfm.model._optim import MultiOptimizer
+from torchfm.model._loss import BPRLoss
+from torchfm.model._loss import WARPLoss
 from torchfm.data._fmdataset import FMDataset
+from torchfm.data._pairwise import NegativeSampler
+from torchfm.data._pairwise import PairwiseFMDataset
+from torchfm.data._sampler import FMBatchSampler
+from torchfm.data.data_utils import collate_batch
+from torchfm.model.evaluation import ranking_metrics
+
+
+def _batch_ranking_metrics(
+    scores: np.ndarray,
+    relevant_rows: np.ndarray,
+    relevant_items: np.ndarray,
+    metrics: list[str],
+    k: int
+) -> dict[str, np.ndarray]:
+    """`ranking_metrics` of a batch of users, the relevant items given as coordinates to keep
+    the arguments sent to a worker small.
+    """
+    relevant = np.zeros(scores.shape, dtype=bool)
+    relevant[relevant_rows, relevant_items] = True
+    return ranking_metrics(scores, relevant, metrics, k)
 
 
 class ModelTrainer:
@@ -17,38 +54,219 @@ class ModelTrainer:
         batch_size: int = 128,
         shuffle: bool = True,
         learning_rate: float=1e-3,
-        weight_decay: float=0
+        weight_decay: float=0,
+        optimizer: Literal["adam", "sparse_adam", "adagrad"] = None,
+        num_workers: int = 0,
+        pin_memory: bool = False,
+        loss: Literal["mse", "bpr", "warp"] = "mse",
+        num_negatives: int = 1,
+        negative_sampling: Literal["uniform", "popularity"] = "uniform",
+        distributed: bool = False,
+        gradient_accumulation_steps: int = 1,
+        checkpoint_dir: str | Path = None,
+        seed: int = 0,
+        callbacks: list[Callback] = None
     ) -> None:
+        """
+        Args:
+            weight_decay (float): L2 regularization. With a sparse optimizer it is applied
+                lazily, to the rows of the features present in each batch only.
+            optimizer (str): "adam" for dense models, "sparse_adam" for models with sparse
+                gradients, whose steps only update the rows in the batch, "adagrad" for either.
+                Defaults to "sparse_adam" when `model.sparse`, otherwise "adam".
+            loss (str): "mse" regresses the ratings, "bpr" and "warp" train on implicit feedback
+                by ranking every interacted item above `num_negatives` sampled items.
+            num_negatives (int): Negatives per positive of the pairwise losses
+            negative_sampling (str): Draw the negatives uniformly or by item popularity
+            distributed (bool): Train data-parallel with `DistributedDataParallel` on the gloo
+                backend, every process training on its own shard of the interactions. The
+                processes are expected to be launched by `torchrun`, which provides the
+                rendezvous environment variables.
+            gradient_accumulation_steps (int): Number of batches whose gradients are summed
+                before each optimizer step, they are only synchronized on the last one
+            checkpoint_dir (str | Path): Save a checkpoint there after every epoch, from rank 0
+            seed (int): Seed of the shuffling, shared by all the processes when distributed, and
+                of the negative sampling, combined with the rank so each process draws its own
+            callbacks (list[Callback]): Hooks receiving the per-phase timings of every batch and
+                the throughput of every epoch, e.g. `MetricsLogger` or `ProfilerCallback`
+        """
         self._model = model
-        self._optimizer = Adam(
-            model.parameters(),
-            lr=learning_rate,
-            weight_decay=weight_decay
+        self._dataset = dataset
+        self._network = model
+        self._rank = 0
+        self._world_size = 1
+        if distributed:
+            if not dist.is_initialized():
+                dist.init_process_group(backend="gloo")
+            self._rank = dist.get_rank()
+            self._world_size = dist.get_world_size()
+            self._network = DistributedDataParallel(model)
+        self._distributed = distributed
+        self._accumulation_steps = gradient_accumulation_steps
+        self._checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir is not None else None
+        self._epoch = 0
+        self._callbacks = list(callbacks) if callbacks is not None else []
+        if optimizer is None:
+            optimizer = "sparse_adam" if model.sparse else "adam"
+        if optimizer not in ("adam", "sparse_adam", "adagrad"):
+            raise ValueError(f"Unknown optimizer {optimizer!r}, use `adam`, `sparse_adam` or `adagrad`.")
+        if optimizer == "adam" and model.sparse:
+            raise ValueError("Adam does not support sparse gradients, use `sparse_adam` or `adagrad`.")
+        if optimizer == "sparse_adam" and not model.sparse:
+            raise ValueError("SparseAdam only supports sparse gradients, use `adam` or `adagrad`.")
+        self._lazy_weight_decay = 0
+        if optimizer == "adam":
+            self._optimizer = Adam(
+                model.parameters(),
+                lr=learning_rate,
+                weight_decay=weight_decay
+            )
+        elif optimizer == "adagrad":
+            self._lazy_weight_decay = weight_decay
+            self._optimizer = Adagrad(model.parameters(), lr=learning_rate)
+        else:
+            self._lazy_weight_decay = weight_decay
+            # SparseAdam only accepts sparse gradients, the dense ones go to Adam
+            sparse = [p for n, p in model.named_parameters() if n != "_bias"]
+            dense = [p for n, p in model.named_parameters() if n == "_bias"]
+            self._optimizer = MultiOptimizer([
+                SparseAdam(sparse, lr=learning_rate), Adam(dense, lr=learning_rate)
+            ])
+        if loss not in ("mse", "bpr", "warp"):
+            raise ValueError(f"Unknown loss {loss!r}, use `mse`, `bpr` or `warp`.")
+        self._pairwise = loss != "mse"
+        if self._pairwise:
+            if loss == "bpr":
+                self._criterion = BPRLoss()
+            else:
+                self._criterion = WARPLoss(num_items=dataset.num_items)
+            sampler = NegativeSampler(dataset, num_negatives, negative_sampling, seed=[seed, self._rank])
+            train_dataset = PairwiseFMDataset(dataset, sampler)
+        else:
+            self._criterion = MSELoss()
+            train_dataset = dataset
+        self._batch_sampler = FMBatchSampler(
+            len(dataset), batch_size, shuffle, seed=seed,
+            num_replicas=self._world_size, rank=self._rank
         )
-        self._criterion = MSELoss()
         self._data_loader = DataLoader(
-            dataset,
-            batch_size=batch_size,
-            shuffle=shuffle
+            train_dataset,
+            batch_sampler=self._batch_sampler,
+            collate_fn=collate_batch,
+            num_workers=num_workers,
+            pin_memory=pin_memory,
+            persistent_workers=num_workers > 0,
+            # The workers reseed their negative sampler from it
+            generator=torch.Generator().manual_seed(seed * 65536 + self._rank)
         )
 
+    def _compute_loss(self, batch) -> tuple[torch.Tensor, int]:
+        if self._pairwise:
+            inputs = batch
+            z = self._network(*inputs) # Output (B, 1 + num_negatives)
+            loss = self._criterion(z[:, 0], z[:, 1:])
+        else:
+            *inputs, y = batch
+            z = self._network(*inputs)
+            loss = self._criterion(z, y)
+
+        if self._lazy_weight_decay > 0:
+            loss = loss + 0.5 * self._lazy_weight_decay * self._model.l2_penalty(*inputs)
+        return loss, z.shape[0]
+
+    def _callback(self, hook: str, *args) -> None:
+        for callback in self._callbacks:
+            getattr(callback, hook)(self, *args)
+
     def train(self, num_epochs: int = 5) -> None:
         start = time.time()
         
         logger.info(f"Completed create DataLoader.")
-        epoch_bar = tqdm(range(num_epochs), desc=f"Training")
+        num_batches = len(self._data_loader)
+        total_samples = 0
+        self._callback("on_train_begin")
+        epoch_bar = tqdm(range(num_epochs), desc=f"Training", disable=self._rank != 0)
         with epoch_bar:
             for _ in epoch_bar:
+                self._callback("on_epoch_begin", self._epoch)
+                self._batch_sampler.set_epoch(self._epoch)
+                self._optimizer.zero_grad()
+                totals = dict.fromkeys(
+                    ["loss", "samples", "data_time", "forward_time", "backward_time", "step_time"], 0)
+                epoch_peak_rss = rss_mb()
+                epoch_start = tick = time.perf_counter()
                 for batch_idx, batch in enumerate(self._data_loader):
-                    self._optimizer.zero_grad()
-                    u, i, y = batch
-                    z = self._model(u, i)
-                    loss = self._criterion(z, y)
-                    loss.backward()
-                    self._optimizer.step()
-                    epoch_bar.set_postfix(loss=f"{loss:.4f}", batch=f"{batch_idx + 1}")
+                    logs = {"data_time": time.perf_counter() - tick}
+                    step = ((batch_idx + 1) % self._accumulation_steps == 0
+                            or batch_idx + 1 == num_batches)
+                    # The last group of an epoch may be shorter, its gradients are averaged over
+                    # the batches it has
+                    group_start = batch_idx - batch_idx % self._accumulation_steps
+                    group_size = min(self._accumulation_steps, num_batches - group_start)
+                    # Gradients are only all-reduced on the batch the optimizer steps on
+                    sync = nullcontext() if step or not self._distributed else self._network.no_sync()
+                    with sync:
+                        tick = time.perf_counter()
+                        with record_function("forward"):
+                            loss, logs["samples"] = self._compute_loss(batch)
+                        logs["forward_time"] = time.perf_counter() - tick
+                        tick = time.perf_counter()
+                        with record_function("backward"):
+                            (loss / group_size).backward()
+                        logs["backward_time"] = time.perf_counter() - tick
+                    tick = time.perf_counter()
+                    if step:
+                        with record_function("step"):
+                            self._optimizer.step()
+                            self._optimizer.zero_grad()
+                    logs["step_time"] = time.perf_counter() - tick
+                    logs["loss"] = loss.item()
+                    epoch_bar.set_postfix(loss=f"{logs['loss']:.4f}", batch=f"{batch_idx + 1}")
+
+                    totals["loss"] += logs["loss"] * logs["samples"]
+                    for key in totals.keys() - {"loss"}:
+                        totals[key] += logs[key]
+                    self._callback("on_batch_end", batch_idx, logs)
+                    # Sampled at batch ends, the peaks inside a batch are not seen
+                    epoch_peak_rss = max(epoch_peak_rss, rss_mb())
+                    tick = time.perf_counter()
+
+                seconds = time.perf_counter() - epoch_start
+                samples = totals.pop("samples")
+                total_samples += samples
+                epoch_logs = {
+                    "epoch": self._epoch,
+                    "rank": self._rank,
+                    "batches": num_batches,
+                    "samples": samples,
+                    "loss": totals.pop("loss") / max(samples, 1),
+                    "seconds": seconds,
+                    "samples_per_sec": samples / seconds if seconds > 0 else 0.0,
+                    **totals,
+                    "peak_rss_mb": epoch_peak_rss,
+                    "process_peak_rss_mb": process_peak_rss_mb()
+                }
+                if self._rank == 0:
+                    logger.info(
+                        f"Epoch {self._epoch}: {epoch_logs['samples_per_sec']:.0f} samples/sec, "
+                        f"data {totals['data_time']:.2f}s, forward {totals['forward_time']:.2f}s, "
+                        f"backward {totals['backward_time']:.2f}s, step {totals['step_time']:.2f}s, "
+                        f"peak RSS {epoch_logs['peak_rss_mb']:.0f} MiB"
+                    )
+                self._callback("on_epoch_end", self._epoch, epoch_logs)
+
+                self._epoch += 1
+                if self._checkpoint_dir is not None:
+                    self.save_checkpoint(self._checkpoint_dir.joinpath(f"epoch_{self._epoch}.pt"))
 
         taken = time.time() - start
+        self._callback("on_train_end", {
+            "epochs": num_epochs,
+            "samples": total_samples,
+            "seconds": taken,
+            "samples_per_sec": total_samples / taken if taken > 0 else 0.0,
+            "process_peak_rss_mb": process_peak_rss_mb()
+        })
         if taken >= 3600:
             logger.info(f"Total training time: {taken/3600:.2f} hours")
         elif taken >= 60:
@@ -56,22 +274,175 @@ class ModelTrainer:
         else:  # Less than a minute
             logger.info(f"Total training time: {taken:.2f} seconds")
 
+    def save_checkpoint(self, path: str | Path) -> None:
+        """Save the model and optimizer states. When distributed, only rank 0 writes and the
+        other processes wait for it.
+        """
+        if self._rank == 0:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            torch.save({
+                "epoch": self._epoch,
+                "model": self._model.state_dict(),
+                "optimizer": self._optimizer.state_dict()
+            }, path)
+            logger.info(f"Saved checkpoint {path}.")
+        if self._distributed:
+            dist.barrier()
+
+    def load_checkpoint(self, path: str | Path) -> None:
+        checkpoint = torch.load(path, map_location="cpu")
+        self._model.load_state_dict(checkpoint["model"])
+        self._optimizer.load_state_dict(checkpoint["optimizer"])
+        self._epoch = checkpoint["epoch"]
+
     def predict_by_id(self, user_id: int, item_id: int):
-        dataset = self._data_loader.dataset
+        dataset = self._dataset
         user_features = dataset.get_user_features_by_id(user_id)
         item_features = dataset.get_item_features_by_id(item_id)
         u_vector, i_vector = dataset.transform(user_features, item_features, user_id, item_id)
-        score = self._model(u_vector, i_vector).item()
+        if dataset.sparse:
+            offsets = torch.zeros(1, dtype=torch.int64)
+            score = self._model(u_vector, i_vector, offsets, offsets).item()
+        else:
+            score = self._model(u_vector, i_vector).item()
         return score
 
+    @torch.no_grad()
+    def recommend(
+        self,
+        user_ids: list[int],
+        k: int = 10,
+        exclude_seen: bool = True,
+        batch_size: int = 1024
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Rank the whole item catalog for each user. The item embeddings and biases are
+        computed once, then every batch of `batch_size` users is scored with one matrix multiply
+        followed by a top-k.
+
+        Args:
+            user_ids (list[int]): Users to recommend for
+            k (int): Number of items per user
+            exclude_seen (bool): Skip the items the user interacted with in the training set
+            batch_size (int): Number of users scored at once, bounds the (batch_size, N) scores
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Item ids and scores, both in shape (len(user_ids), k).
+                When fewer than k items are left to recommend to a user, e.g. after excluding
+                the seen ones, the missing entries have the id -1 and the score -inf.
+        """
+        dataset = self._dataset
+        user_rows = dataset.get_user_rows(user_ids)
+        k = min(k, dataset.num_items)
+        i_emb, i_bias = self._item_table()
+
+        item_rows = np.zeros((len(user_rows), k), dtype=np.int64)
+        item_scores = np.zeros((len(user_rows), k), dtype=np.float32)
+        for start in range(0, len(user_rows), batch_size):
+            rows = user_rows[start:start + batch_size]
+            scores = self._score_user_rows(rows, i_emb, i_bias, exclude_seen)
+            top_scores, top_rows = torch.topk(scores, k, dim=1)
+            item_rows[start:start + batch_size] = top_rows.numpy()
+            item_scores[start:start + batch_size] = top_scores.numpy()
+        # Excluded items are scored -inf, they are not recommendations
+        missing = np.isneginf(item_scores)
+        item_ids = dataset.get_item_ids(np.where(missing, 0, item_rows))
+        item_ids[missing] = -1
+        return item_ids, item_scores
+
+    def _item_table(self) -> tuple[torch.Tensor, torch.Tensor]:
+        dataset = self._dataset
+        return self._model.item_representations(
+            *dataset.encode_item_rows(np.arange(dataset.num_items)))
+
+    def _score_user_rows(
+        self,
+        user_rows: np.ndarray,
+        i_emb: torch.Tensor,
+        i_bias: torch.Tensor,
+        exclude_seen: bool
+    ) -> torch.Tensor:
+        """Score users against the whole catalog, seen items are set to -inf if excluded."""
+        dataset = self._dataset
+        u_emb, u_bias = self._model.user_representations(*dataset.encode_user_rows(user_rows))
+        scores = self._model.score_all(u_emb, u_bias, i_emb, i_bias)
+        if exclude_seen:
+            positions, seen = dataset.get_interacted_item_rows(user_rows)
+            scores[torch.from_numpy(positions), torch.from_numpy(seen)] = -torch.inf
+        return scores
+
+    @torch.no_grad()
     def evaluate(
         self,
         dataset: FMDataset,
-        metrics: list[Literal["mse", "auc", "precision@k", "recall@k", "map@k"]]
-    ):
-        scores = []
-        actuals = []
-        for user_id, item_id, actual in dataset._interactions:
-            scores.append(self.predict_by_id(user_id, item_id))
-            actuals.append(actual)
-        return scores
\ No newline at end of file
+        metrics: list[Literal["mse", "auc", "precision@k", "recall@k", "map@k"]],
+        k: int = 10,
+        exclude_seen: bool = True,
+        batch_size: int = 1024,
+        num_workers: int = 0
+    ) -> dict[str, float]:
+        """Evaluate on a held-out dataset whose users and items are known to the training set.
+
+        The "mse" is computed on the held-out interactions, scored `batch_size` at a time. The
+        ranking metrics score each held-out user against the whole catalog, the held-out items
+        being the relevant ones, and are averaged over users.
+
+        Args:
+            dataset (FMDataset): Held-out interactions
+            metrics (list[str]): Metrics to compute
+            k (int): Cut-off rank of the @k metrics
+            exclude_seen (bool): Drop the items seen in training from the candidates
+            batch_size (int): Number of interactions or users scored at once
+            num_workers (int): Compute the ranking metrics of each batch of users in a pool of
+                `num_workers` processes, 0 computes them in the current process
+        Returns:
+            dict[str, float]: Value of every requested metric
+        """
+        train = self._dataset
+        user_ids, item_ids, ratings = dataset.get_interactions()
+        user_rows = train.get_user_rows(user_ids)
+        item_rows = train.get_item_rows(item_ids)
+        results = {}
+
+        if "mse" in metrics:
+            errors = np.zeros(len(ratings), dtype=np.float64)
+            for start in range(0, len(ratings), batch_size):
+                end = start + batch_size
+                u, u_offsets = train.encode_user_rows(user_rows[start:end])
+                i, i_offsets = train.encode_item_rows(item_rows[start:end])
+                z = self._model(u, i, u_offsets, i_offsets).numpy()
+                errors[start:end] = (z - ratings[start:end]) ** 2
+            results["mse"] = float(errors.mean())
+
+        ranking = [m for m in metrics if m != "mse"]
+        if len(ranking) == 0:
+            return results
+
+        k = min(k, train.num_items)
+        order = np.argsort(user_rows, kind="stable")
+        user_rows, item_rows = user_rows[order], item_rows[order]
+        users = np.unique(user_rows)
+        bounds = np.searchsorted(user_rows, users)
+        bounds = np.append(bounds, len(user_rows))
+        i_emb, i_bias = self._item_table()
+
+        batches = []
+        with ProcessPoolExecutor(num_workers) if num_workers > 0 else nullcontext() as executor:
+            pending = deque()
+            for start in range(0, len(users), batch_size):
+                rows = users[start:start + batch_size]
+                scores = self._score_user_rows(rows, i_emb, i_bias, exclude_seen).numpy()
+                lo, hi = bounds[start], bounds[start + len(rows)]
+                args = (scores, np.searchsorted(rows, user_rows[lo:hi]), item_rows[lo:hi], ranking, k)
+                if executor is None:
+                    batches.append(_batch_ranking_metrics(*args))
+                    continue
+                # A pending batch holds its (batch_size, num_items) scores, bound how many wait
+                if len(pending) >= 2 * num_workers:
+                    batches.append(pending.popleft().result())
+                pending.append(executor.submit(_batch_ranking_metrics, *args))
+            batches += [future.result() for future in pending]
+
+        for metric in ranking:
+            values = np.concatenate([batch[metric] for batch in batches])
+            results[metric] = float(np.nanmean(values))
+        return results
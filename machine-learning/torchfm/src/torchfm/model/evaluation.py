@@ -3,6 +3,10 @@ import numpy as np
 def auc_score(predicted_scores, many_hot_vector):
     """
     Calculate AUC using a many-hot vector.
+
+    The AUC is the normalized Mann-Whitney U statistic: the items are ranked by score (tied
+    items share their average rank) and the rank sum of the positives is compared with its
+    minimum, which costs O(n log n) instead of comparing every positive with every negative.
     
     Parameters:
         predicted_scores (numpy array): Scores predicted by the model for all items.
@@ -11,9 +15,134 @@ def auc_score(predicted_scores, many_hot_vector):
     Returns:
         float: The AUC value.
     """
-    positive_scores = predicted_scores[many_hot_vector == 1]
-    negative_scores = predicted_scores[many_hot_vector == 0]
-    comparisons = positive_scores[:, None] > negative_scores[None, :]
-    ties = positive_scores[:, None] == negative_scores[None, :]
-    auc = (np.sum(comparisons) + 0.5 * np.sum(ties)) / (len(positive_scores) * len(negative_scores))
-    return auc
\ No newline at end of file
+    predicted_scores = np.asarray(predicted_scores)
+    indptr = np.array([0, len(predicted_scores)])
+    return csr_auc_score(predicted_scores, np.asarray(many_hot_vector), indptr)[0]
+
+
+def csr_auc_score(predicted_scores, labels, indptr):
+    """
+    Calculate the AUC of many users at once from ragged (CSR) input, user `u` owning the
+    entries `indptr[u]:indptr[u + 1]` of `predicted_scores` and `labels`.
+
+    Parameters:
+        predicted_scores (numpy array): Flat scores of every user (shape: [nnz]).
+        labels (numpy array): Flat binary labels, 1 for a positive item (shape: [nnz]).
+        indptr (numpy array): Row pointers (shape: [num_users + 1]).
+
+    Returns:
+        numpy array: AUC of every user, NaN for users without positives or negatives.
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    lengths = np.diff(indptr)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    order = np.lexsort((predicted_scores, rows))
+    sorted_scores = predicted_scores[order]
+    positives = np.asarray(labels)[order] == 1
+
+    # Tied scores of a user form a group sharing the average of its 1-based ranks
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = (sorted_scores[1:] != sorted_scores[:-1]) | (rows[1:] != rows[:-1])
+    groups = np.cumsum(starts) - 1
+    first_rank = np.arange(len(order))[starts] - indptr[rows[starts]] + 1
+    group_rank = first_rank + (np.bincount(groups) - 1) / 2
+    ranks = group_rank[groups]
+
+    num_pos = np.bincount(rows[positives], minlength=len(lengths))
+    num_neg = lengths - num_pos
+    rank_sum = np.bincount(rows[positives], weights=ranks[positives], minlength=len(lengths))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (rank_sum - num_pos * (num_pos + 1) / 2) / (num_pos * num_neg)
+
+
+def batch_auc_score(predicted_scores, labels, mask=None):
+    """
+    Calculate the AUC of every row of a padded score matrix, see `csr_auc_score`.
+
+    Parameters:
+        predicted_scores (numpy array): Scores of every item for every user (shape: [B, N]).
+        labels (numpy array): Binary labels, 1 for a positive item (shape: [B, N]).
+        mask (numpy array, optional): Boolean matrix of the valid entries, padding and
+            excluded items are False (shape: [B, N]).
+
+    Returns:
+        numpy array: AUC of every user (shape: [B]).
+    """
+    predicted_scores = np.asarray(predicted_scores)
+    labels = np.asarray(labels)
+    if mask is None:
+        mask = np.ones(predicted_scores.shape, dtype=bool)
+    indptr = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask.sum(axis=1), out=indptr[1:])
+    return csr_auc_score(predicted_scores[mask], labels[mask], indptr)
+
+
+def _top_k_hits(scores, relevant, k):
+    """Relevance of the k best scored items of every row, in rank order (shape: [B, k])."""
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(relevant, top, axis=1)
+
+
+def precision_at_k(scores, relevant, k=10):
+    """
+    Calculate precision@k for a batch of users.
+
+    Parameters:
+        scores (numpy array): Scores of every item for every user (shape: [B, N]).
+        relevant (numpy array): Boolean matrix of the relevant items (shape: [B, N]).
+        k (int): Cut-off rank.
+
+    Returns:
+        numpy array: precision@k of every user (shape: [B]).
+    """
+    hits = _top_k_hits(scores, relevant, k)
+    return hits.sum(axis=1) / k
+
+
+def recall_at_k(scores, relevant, k=10):
+    """
+    Calculate recall@k for a batch of users, see `precision_at_k`.
+    Users without relevant items get NaN.
+    """
+    hits = _top_k_hits(scores, relevant, k)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return hits.sum(axis=1) / relevant.sum(axis=1)
+
+
+def average_precision_at_k(scores, relevant, k=10):
+    """
+    Calculate AP@k for a batch of users, see `precision_at_k`. The mean over users is MAP@k.
+    Users without relevant items get NaN.
+    """
+    hits = _top_k_hits(scores, relevant, k)
+    precisions = np.cumsum(hits, axis=1) / np.arange(1, k + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (precisions * hits).sum(axis=1) / np.minimum(relevant.sum(axis=1), k)
+
+
+def ranking_metrics(scores, relevant, metrics, k=10):
+    """
+    Compute the ranking metrics of a batch of users. Items scored -inf are not candidates,
+    e.g. the items seen in training, and are left out of the AUC.
+
+    Parameters:
+        scores (numpy array): Scores of every item for every user (shape: [B, N]).
+        relevant (numpy array): Boolean matrix of the relevant items (shape: [B, N]).
+        metrics (list[str]): Any of "auc", "precision@k", "recall@k" and "map@k".
+        k (int): Cut-off rank.
+
+    Returns:
+        dict[str, numpy array]: The metric of every user (shape: [B]).
+    """
+    results = {}
+    if "auc" in metrics:
+        results["auc"] = batch_auc_score(scores, relevant, np.isfinite(scores))
+    if "precision@k" in metrics:
+        results["precision@k"] = precision_at_k(scores, relevant, k)
+    if "recall@k" in metrics:
+        results["recall@k"] = recall_at_k(scores, relevant, k)
+    if "map@k" in metrics:
+        results["map@k"] = average_precision_at_k(scores, relevant, k)
+    return results
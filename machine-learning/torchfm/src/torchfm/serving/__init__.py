@@ -0,0 +1,12 @@
+from torchfm.serving._tables import Scorer
+from torchfm.serving._tables import FrozenTables
+from torchfm.serving._export import export
+from torchfm.serving._export import ExportedFM
+from torchfm.serving._ann import IVFIndex
+from torchfm.serving._metrics import Histogram
+from torchfm.serving._batcher import MicroBatcher
+from torchfm.serving._server import ScoringServer
+
+__all__ = [
+    "Scorer", "FrozenTables", "export", "ExportedFM", "IVFIndex", "Histogram", "MicroBatcher", "ScoringServer"
+]
@@ -0,0 +1,56 @@
+"""Serve frozen tables written by `FrozenTables.save`, or a model written by `export`.
+
+    python -m torchfm.serving ./tables --port 8000 --max-batch-size 256 --max-wait-ms 1
+    python -m torchfm.serving ./tables --index ./index --nprobe 16
+"""
+import argparse
+import asyncio
+import json
+import torch
+from pathlib import Path
+from torchfm.serving._ann import IVFIndex
+from torchfm.serving._export import FORMAT
+from torchfm.serving._export import ExportedFM
+from torchfm.serving._server import ScoringServer
+from torchfm.serving._tables import FrozenTables
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a TorchFM model over HTTP.")
+    parser.add_argument("tables", help="Directory written by `FrozenTables.save` or `export`")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=1.0)
+    parser.add_argument("--threads", type=int, default=2, help="Threads scoring the batches")
+    parser.add_argument("--torch-threads", type=int, default=1,
+                        help="Intra-op threads of every scoring thread")
+    parser.add_argument("--index", help="Directory written by `IVFIndex.save`, for /recommend")
+    parser.add_argument("--nprobe", type=int, help="Lists scanned per query, defaults to the saved one")
+    args = parser.parse_args(argv)
+
+    # Several scoring threads each using every core would oversubscribe the CPU
+    torch.set_num_threads(args.torch_threads)
+    meta = json.loads(Path(args.tables).joinpath("meta.json").read_text())
+    scorer = ExportedFM.load(args.tables) if meta.get("format") == FORMAT else FrozenTables.load(args.tables)
+    index = None
+    if args.index is not None:
+        index = IVFIndex.load(args.index)
+        index.nprobe = args.nprobe or index.nprobe
+    server = ScoringServer(
+        scorer,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        num_threads=args.threads,
+        index=index
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import json
+import time
+import numpy as np
+from pathlib import Path
+from loguru import logger
+from torchfm.data._fmdataset import write_arrays
+
+
+def _augment(item_embeddings: np.ndarray, item_biases: np.ndarray) -> np.ndarray:
+    """Fold the item biases into the embeddings, u.i + b_i = [u, 1].[i, b_i], so that ranking
+    the items for a user is a maximum inner product search.
+    """
+    return np.hstack([item_embeddings, item_biases[:, None]]).astype(np.float32)
+
+
+def _to_euclidean(vectors: np.ndarray) -> np.ndarray:
+    """Append sqrt(M^2 - |x|^2) to every vector, M being the largest norm. All the vectors then
+    have the norm M, and for a query [q, 0], |q - x|^2 = |q|^2 + M^2 - 2 q.x: the nearest
+    neighbours are the largest inner products, and k-means clusters them meaningfully.
+    """
+    norms = (vectors ** 2).sum(axis=1)
+    return np.hstack([vectors, np.sqrt(np.maximum(norms.max() - norms, 0))[:, None]])
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """Nearest centroid of every row of `x`, in batches to bound the distance matrix."""
+    squared = (centroids ** 2).sum(axis=1)
+    nearest = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), batch_size):
+        distances = squared[None, :] - 2 * x[start:start + batch_size] @ centroids.T
+        nearest[start:start + batch_size] = distances.argmin(axis=1)
+    return nearest
+
+
+def _kmeans(x: np.ndarray, num_clusters: int, num_iters: int, rng: np.random.Generator) -> np.ndarray:
+    """Lloyd's k-means, emptied clusters are reseeded with random points."""
+    centroids = x[rng.choice(len(x), num_clusters, replace=False)].copy()
+    for _ in range(num_iters):
+        assignment = _nearest(x, centroids)
+        counts = np.bincount(assignment, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = x[rng.choice(len(x), empty.sum(), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    def __init__(
+        self,
+        num_lists: int = None,
+        nprobe: int = 8,
+        num_iters: int = 20,
+        max_train_points: int = 256,
+        seed: int = 0
+    ) -> None:
+        """An inverted file index for the top-k items of a user, a score being the inner product
+        of the user embedding with the item embedding plus the item bias.
+
+        The items are bias-augmented and mapped so that the largest inner products are the
+        nearest neighbours, then clustered by k-means into `num_lists` lists. A query only
+        scores the items of the `nprobe` lists whose centroids are the nearest, exactly. More
+        probes raise the recall and the latency, see `recall_report` and `tune`.
+
+        Args:
+            num_lists (int): Number of clusters, defaults to sqrt of the number of items
+            nprobe (int): Lists scanned per query
+            num_iters (int): Iterations of k-means
+            max_train_points (int): k-means is trained on at most this many items per list
+            seed (int): Seed of k-means
+        """
+        self.num_lists = num_lists
+        self.nprobe = nprobe
+        self.num_iters = num_iters
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self._centroids = None
+        self._indptr = None
+        self._items = None
+        self._vectors = None
+
+    @property
+    def num_items(self) -> int:
+        return len(self._items)
+
+    def build(self, item_embeddings: np.ndarray, item_biases: np.ndarray) -> "IVFIndex":
+        """Index the item table, e.g. the `item_table()` of a `Scorer`. The rows of the table
+        are the item rows returned by `search`.
+        """
+        vectors = _augment(np.asarray(item_embeddings), np.asarray(item_biases))
+        points = _to_euclidean(vectors)
+        num_lists = self.num_lists or max(1, int(np.sqrt(len(points))))
+        num_lists = min(num_lists, len(points))
+        rng = np.random.default_rng(self.seed)
+        sample = points
+        if len(points) > num_lists * self.max_train_points:
+            sample = points[rng.choice(len(points), num_lists * self.max_train_points, replace=False)]
+
+        start = time.time()
+        self._centroids = _kmeans(sample, num_lists, self.num_iters, rng).astype(np.float32)
+        assignment = _nearest(points, self._centroids)
+        # The items are stored list after list, so a probe scans contiguous memory
+        self._items = np.argsort(assignment, kind="stable")
+        self._indptr = np.searchsorted(assignment[self._items], np.arange(num_lists + 1))
+        self._vectors = vectors[self._items]
+        self.num_lists = num_lists
+        logger.info(f"Built an IVF index of {len(points)} items in {num_lists} lists "
+                    f"in {time.time() - start:.2f} seconds.")
+        return self
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        write_arrays(path, {
+            "centroids": self._centroids,
+            "indptr": self._indptr,
+            "items": self._items,
+            "vectors": self._vectors
+        })
+        path.joinpath("index.json").write_text(json.dumps({
+            "num_lists": self.num_lists,
+            "nprobe": self.nprobe,
+            "num_iters": self.num_iters,
+            "max_train_points": self.max_train_points,
+            "seed": self.seed
+        }))
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "IVFIndex":
+        path = Path(path)
+        index = cls(**json.loads(path.joinpath("index.json").read_text()))
+        for name in ["centroids", "indptr", "items", "vectors"]:
+            array = np.load(path.joinpath(f"{name}.npy"), mmap_mode="r" if mmap else None)
+            setattr(index, f"_{name}", array)
+        return index
+
+    def _probe(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        """Lists of the `nprobe` centroids nearest to the bias-augmented queries, in shape (B, nprobe)."""
+        # The queries are [q, 0] in the Euclidean space, the last dimension of the centroids
+        # does not count
+        distances = (self._centroids ** 2).sum(axis=1)[None, :] - 2 * queries @ self._centroids[:, :-1].T
+        return np.argpartition(distances, nprobe - 1, axis=1)[:, :nprobe]
+
+    def search(
+        self,
+        user_embeddings: np.ndarray,
+        k: int = 10,
+        nprobe: int = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k items of every user.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Item rows and scores without the user and global
+                biases, in shape (B, k), k being at most the number of items. When the probed
+                lists hold fewer than k items, the missing rows are -1 with a score of -inf.
+        """
+        # The padded candidates are at least (B, k), a k beyond the catalog would only pad them
+        k = min(k, self.num_items)
+        queries = np.asarray(user_embeddings, dtype=np.float32)
+        queries = np.hstack([queries, np.ones((len(queries), 1), dtype=np.float32)])
+        nprobe = min(nprobe or self.nprobe, self.num_lists)
+        probes = self._probe(queries, nprobe)
+
+        # Score every probed list against all the queries probing it with one matrix product
+        pair_queries = np.repeat(np.arange(len(queries)), nprobe)
+        pair_lists = probes.ravel()
+        order = np.argsort(pair_lists, kind="stable")
+        pair_queries, pair_lists = pair_queries[order], pair_lists[order]
+        bounds = np.flatnonzero(np.diff(pair_lists)) + 1
+        owners, positions, scores = [], [], []
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(pair_lists)]):
+            low, high = self._indptr[pair_lists[start]], self._indptr[pair_lists[start] + 1]
+            if high == low:
+                continue
+            members = pair_queries[start:end]
+            list_scores = queries[members] @ self._vectors[low:high].T  # Output (Q, L)
+            # Only the top-k of a list can be in the top-k of a query
+            if high - low > k:
+                top = np.argpartition(-list_scores, k - 1, axis=1)[:, :k]
+                list_scores = np.take_along_axis(list_scores, top, axis=1)
+            else:
+                top = np.broadcast_to(np.arange(high - low), list_scores.shape)
+            owners.append(np.repeat(members, top.shape[1]))
+            positions.append((low + top).ravel())
+            scores.append(list_scores.ravel())
+        owners = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int64)
+        positions = np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64)
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+        # Pad the candidates of every query into a matrix for a row-wise top-k
+        order = np.argsort(owners, kind="stable")
+        owners, positions, scores = owners[order], positions[order], scores[order]
+        candidates = np.bincount(owners, minlength=len(queries))
+        columns = np.arange(len(owners)) - np.repeat(np.cumsum(candidates) - candidates, candidates)
+        width = max(int(candidates.max(initial=0)), k)
+        padded_scores = np.full((len(queries), width), -np.inf, dtype=np.float32)
+        padded_positions = np.full((len(queries), width), -1, dtype=np.int64)
+        padded_scores[owners, columns] = scores
+        padded_positions[owners, columns] = positions
+
+        top = np.argpartition(-padded_scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(padded_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        top_positions = np.take_along_axis(np.take_along_axis(padded_positions, top, axis=1), order, axis=1)
+        top_rows = np.where(top_positions >= 0, self._items[np.maximum(top_positions, 0)], -1)
+        return top_rows, top_scores
+
+    def _exact(self, queries: np.ndarray, k: int, batch_size: int = 1024) -> np.ndarray:
+        k = min(k, self.num_items)
+        queries = np.hstack([queries, np.ones((len(queries), 1), dtype=np.float32)])
+        rows = []
+        for start in range(0, len(queries), batch_size):
+            scores = queries[start:start + batch_size] @ self._vectors.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            rows.append(self._items[top])
+        return np.concatenate(rows)
+
+    def recall_report(
+        self,
+        user_embeddings: np.ndarray,
+        k: int = 10,
+        nprobes: tuple[int, ...] = (1, 2, 4, 8, 16, 32, 64)
+    ) -> list[dict]:
+        """Measure the recall@k of `search` against exact scoring, for several `nprobe`.
+
+        Returns:
+            list[dict]: Per nprobe, the recall, the fraction of the catalog scanned and the
+                search latency per query in milliseconds
+        """
+        queries = np.asarray(user_embeddings, dtype=np.float32)
+        k = min(k, self.num_items)
+        exact = self._exact(queries, k)
+        start = time.perf_counter()
+        self._exact(queries, k)
+        exact_ms = (time.perf_counter() - start) / len(queries) * 1e3
+        augmented = np.hstack([queries, np.ones((len(queries), 1), dtype=np.float32)])
+        lengths = np.diff(self._indptr)
+
+        report = []
+        for nprobe in sorted({min(n, self.num_lists) for n in nprobes}):
+            start = time.perf_counter()
+            rows, _ = self.search(queries, k, nprobe)
+            latency_ms = (time.perf_counter() - start) / len(queries) * 1e3
+            hits = [len(np.intersect1d(a, b)) for a, b in zip(rows, exact)]
+            scanned = lengths[self._probe(augmented, nprobe)].sum(axis=1).mean()
+            report.append({
+                "nprobe": nprobe,
+                f"recall@{k}": float(np.mean(hits) / k),
+                "scanned": float(scanned / self.num_items),
+                "latency_ms": latency_ms,
+                "exact_latency_ms": exact_ms
+            })
+            logger.info(f"nprobe {nprobe}: recall@{k} {report[-1][f'recall@{k}']:.4f}, "
+                        f"scanned {report[-1]['scanned']:.1%}, {latency_ms:.3f} ms per query, "
+                        f"exact {exact_ms:.3f} ms")
+        return report
+
+    def tune(self, user_embeddings: np.ndarray, target_recall: float = 0.95, k: int = 10) -> int:
+        """Set `nprobe` to the smallest power of two reaching `target_recall` on the queries.
+
+        Returns:
+            int: The chosen nprobe
+        """
+        nprobe = 1
+        while True:
+            row = self.recall_report(user_embeddings, k, (nprobe,))[0]
+            if row[f"recall@{min(k, self.num_items)}"] >= target_recall or nprobe >= self.num_lists:
+                break
+            nprobe = min(2 * nprobe, self.num_lists)
+        self.nprobe = row["nprobe"]
+        return self.nprobe
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any
+from typing import Callable
+from torchfm.serving._metrics import Histogram
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        process: Callable[[list[Any]], list[Any]],
+        executor: Executor,
+        max_batch_size: int = 256,
+        max_wait_ms: float = 1.0,
+        name: str = "batch"
+    ) -> None:
+        """Coalesce concurrent requests into batches processed by one call of `process`.
+
+        A batch is closed when it holds `max_batch_size` requests or when its first request has
+        waited `max_wait_ms`, whichever comes first, then `process` runs on `executor` so the
+        event loop keeps accepting requests. The batches are not awaited one after the other:
+        up to one per worker of the executor are processed at once.
+
+        Args:
+            process (Callable): Maps a list of requests to the list of their results, in order.
+                A result that is an exception is raised to its caller only.
+            executor (Executor): Runs `process`, usually a thread pool
+            max_batch_size (int): Maximum number of requests per batch
+            max_wait_ms (float): Maximum time a request waits for the batch to fill
+            name (str): Prefix of the metrics
+        """
+        self.process = process
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes = Histogram(
+            f"torchfm_{name}_size", "Requests per batch",
+            buckets=tuple(2 ** i for i in range(max_batch_size.bit_length() + 1))
+        )
+        self.queue_seconds = Histogram(
+            f"torchfm_{name}_queue_seconds", "Time from a request to the start of its batch")
+        self.process_seconds = Histogram(
+            f"torchfm_{name}_process_seconds", "Time to process a batch")
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        self._pending: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    async def submit(self, request: Any) -> Any:
+        if self._task is None:
+            raise RuntimeError("The batcher is not started.")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # Take what is already queued without yielding to the loop
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.create_task(self._run(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future, float]]) -> None:
+        start = time.perf_counter()
+        for _, _, submitted in batch:
+            self.queue_seconds.observe(start - submitted)
+        self.batch_sizes.observe(len(batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.process, [request for request, _, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        self.process_seconds.observe(time.perf_counter() - start)
+        for (_, future, _), result in zip(batch, results):
+            if future.done():  # The caller went away
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,173 @@
+import json
+import torch
+import numpy as np
+from functools import cached_property
+from pathlib import Path
+from typing import Literal
+from loguru import logger
+from torch import Tensor
+from torch.nn import functional as F
+from torchfm.data._fmdataset import FMDataset
+from torchfm.data._fmdataset import write_arrays
+from torchfm.data._fmdataset import write_vocab
+from torchfm.data.data_utils import csr_gather
+from torchfm.model._torchfm import TorchFM
+from torchfm.serving._tables import FrozenTables
+from torchfm.serving._tables import _as_tensor
+from torchfm.serving._tables import Scorer
+
+FORMAT = "torchfm-export"
+FORMAT_VERSION = 1
+
+
+def _quantize(weight: np.ndarray, dtype: str) -> dict[str, np.ndarray]:
+    """Quantize the rows of an embedding table. int8 is symmetric with a scale per row, so
+    each feature keeps its own range.
+    """
+    if dtype == "int8":
+        scales = np.abs(weight).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return {
+            "embeddings": np.round(weight / scales[:, None]).astype(np.int8),
+            "scales": scales.astype(np.float32)
+        }
+    return {"embeddings": weight.astype(dtype)}
+
+
+@torch.inference_mode()
+def export(
+    model: TorchFM,
+    dataset: FMDataset,
+    path: str | Path,
+    dtype: Literal["float32", "float16", "int8"] = "float32"
+) -> Path:
+    """Write the per-feature embedding and bias tables of `model` as contiguous arrays, with
+    the feature matrices and vocabularies of `dataset`, to be memory-mapped by `ExportedFM`.
+
+    The embeddings can be stored in float16, or in int8 with a float32 scale per feature,
+    halving or quartering them. The biases stay in float32, they are one value per feature.
+
+    Args:
+        model (TorchFM): Trained model
+        dataset (FMDataset): Dataset the model was trained on, for the features of its users
+            and items
+        path (str | Path): Output directory
+        dtype (str): Storage type of the embeddings
+    Returns:
+        Path: The output directory
+    """
+    path = Path(path)
+    arrays = {}
+    for kind in ["user", "item"]:
+        embeddings = getattr(model, f"_{kind}_embeddings").weight.detach().numpy()
+        for name, array in _quantize(embeddings, dtype).items():
+            arrays[f"{kind}_{name}"] = array
+        arrays[f"{kind}_biases"] = getattr(model, f"_{kind}_biases").weight.detach().numpy()[:, 0]
+        rows = np.arange(getattr(dataset, f"num_{kind}s"))
+        indices, offsets = getattr(dataset, f"encode_{kind}_rows")(rows)
+        arrays[f"{kind}_ids"] = getattr(dataset, f"get_{kind}_ids")(rows)
+        arrays[f"{kind}_indptr"] = np.append(offsets.numpy(), len(indices))
+        arrays[f"{kind}_indices"] = indices.numpy()
+    write_arrays(path, arrays)
+    write_vocab(path, dataset.user_features, dataset.item_features)
+    path.joinpath("meta.json").write_text(json.dumps({
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "dtype": dtype,
+        "embedding_dim": model._user_embeddings.embedding_dim,
+        "bias": model._bias.item()
+    }))
+    size = sum(array.nbytes for array in arrays.values())
+    logger.info(f"Exported the model in {dtype} to {path} ({size / 2**20:.1f} MiB).")
+    return path
+
+
+class ExportedFM(Scorer):
+    def __init__(self, arrays: dict[str, np.ndarray], meta: dict, path: Path = None) -> None:
+        """A model written by `export`. The tables are wrapped as tensors without copy, so when
+        memory-mapped they are shared through the page cache by every process loading them.
+        Only the rows of the features of the requested users and items are read, and
+        dequantized, for each call.
+        """
+        if meta.get("format") != FORMAT or meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported export format {meta.get('format')} {meta.get('version')}.")
+        self.dtype = meta["dtype"]
+        self.embedding_dim = meta["embedding_dim"]
+        self.bias = meta["bias"]
+        self.path = path
+        self.user_ids = arrays["user_ids"]
+        self.item_ids = arrays["item_ids"]
+        self._tables = {
+            name: _as_tensor(array) for name, array in arrays.items()
+            if name.endswith(("_embeddings", "_scales", "_biases"))
+        }
+        self._csr = {
+            kind: (arrays[f"{kind}_indptr"], arrays[f"{kind}_indices"]) for kind in ["user", "item"]
+        }
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "ExportedFM":
+        path = Path(path)
+        meta = json.loads(path.joinpath("meta.json").read_text())
+        arrays = {
+            file.stem: np.load(file, mmap_mode="r" if mmap else None)
+            for file in path.glob("*.npy")
+        }
+        return cls(arrays, meta, path)
+
+    def _read_vocab(self, name: str) -> dict:
+        if self.path is None:
+            return {}
+        with open(self.path.joinpath("vocab.json")) as f:
+            return {k: v for k, v in json.load(f)[name]}
+
+    @cached_property
+    def user_features(self) -> dict:
+        """Vocabulary of the user features, read on first access."""
+        return self._read_vocab("user_features")
+
+    @cached_property
+    def item_features(self) -> dict:
+        return self._read_vocab("item_features")
+
+    def _represent(self, kind: str, rows: np.ndarray) -> tuple[Tensor, Tensor]:
+        indptr, indices = self._csr[kind]
+        features, offsets = csr_gather(indptr, indices, np.asarray(rows, dtype=np.int64))
+        features, offsets = torch.from_numpy(features), torch.from_numpy(offsets)
+        biases = F.embedding_bag(features, self._tables[f"{kind}_biases"][:, None], offsets, mode="sum")
+        table = self._tables[f"{kind}_embeddings"]
+        if table.dtype == torch.float32:
+            return F.embedding_bag(features, table, offsets, mode="sum"), biases[:, 0]
+
+        weights = table[features].to(torch.float32)
+        if self.dtype == "int8":
+            weights *= self._tables[f"{kind}_scales"][features, None]
+        lengths = torch.diff(offsets, append=torch.tensor([len(features)]))
+        bags = torch.repeat_interleave(torch.arange(len(offsets)), lengths)
+        embeddings = torch.zeros(len(offsets), self.embedding_dim).index_add_(0, bags, weights)
+        return embeddings, biases[:, 0]
+
+    def user_representations(self, user_rows: np.ndarray) -> tuple[Tensor, Tensor]:
+        return self._represent("user", user_rows)
+
+    def item_representations(self, item_rows: np.ndarray) -> tuple[Tensor, Tensor]:
+        return self._represent("item", item_rows)
+
+    @cached_property
+    def _item_table(self) -> tuple[Tensor, Tensor]:
+        with torch.inference_mode():
+            return self.item_representations(np.arange(self.num_items))
+
+    def item_table(self) -> tuple[Tensor, Tensor]:
+        """The catalog ranked by `top_k` is dequantized once, then kept in float32."""
+        return self._item_table
+
+    @torch.inference_mode()
+    def freeze(self) -> FrozenTables:
+        """Dequantize the representation of every user and item."""
+        user_embeddings, user_biases = self.user_representations(np.arange(self.num_users))
+        item_embeddings, item_biases = self.item_table()
+        return FrozenTables(
+            self.user_ids, user_embeddings.numpy(), user_biases.numpy(),
+            self.item_ids, item_embeddings.numpy(), item_biases.numpy(), self.bias
+        )
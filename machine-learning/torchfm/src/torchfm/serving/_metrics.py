@@ -0,0 +1,68 @@
+import bisect
+import threading
+
+# Upper bounds in seconds, fine below 10 ms where the scoring latency is expected
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.003, 0.005, 0.0075, 0.01,
+    0.015, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str = "", buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """A cumulative histogram rendered in the Prometheus text format, of durations in
+        seconds by default. It is thread-safe, the scoring threads and the event loop both
+        observe.
+        """
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation within its bucket, as Prometheus'
+        `histogram_quantile` does. Observations beyond the last bucket are reported at its bound.
+        """
+        with self._lock:
+            counts, total = list(self._counts), self._count
+        if total == 0:
+            return float("nan")
+        target = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= target and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (target - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def render(self) -> str:
+        with self._lock:
+            counts, total, sum = list(self._counts), self._count, self._sum
+        lines = []
+        if self.help:
+            lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {sum}")
+        lines.append(f"{self.name}_count {total}")
+        return "\n".join(lines)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import time
+import numpy as np
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from http import HTTPStatus
+from loguru import logger
+from torchfm.serving._ann import IVFIndex
+from torchfm.serving._batcher import MicroBatcher
+from torchfm.serving._metrics import Histogram
+from torchfm.serving._tables import Scorer
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = None) -> None:
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class ScoringServer:
+    def __init__(
+        self,
+        scorer: Scorer,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_batch_size: int = 256,
+        max_wait_ms: float = 1.0,
+        num_threads: int = 2,
+        index: IVFIndex = None
+    ) -> None:
+        """An HTTP/1.1 scoring service over frozen representations, on asyncio only.
+
+        Concurrent requests are coalesced by a `MicroBatcher` per route, and every batch is
+        scored at once on a pool of `num_threads` threads, where PyTorch releases the GIL.
+
+        Routes:
+            POST /score {"user_id": 1, "item_ids": [1, 2]} -> {"user_id": 1, "scores": [..]}
+            POST /recommend {"user_id": 1, "k": 10} -> {"user_id": 1, "item_ids": [..], "scores": [..]}
+            GET /metrics: Latency and batch size histograms in the Prometheus text format
+            GET /health
+
+        Args:
+            scorer (Scorer): Representations of the users and items, `FrozenTables` or a
+                memory-mapped `ExportedFM`
+            max_batch_size (int): Maximum number of requests scored at once
+            max_wait_ms (float): Maximum time a request waits for its batch to fill
+            num_threads (int): Threads scoring the batches
+            index (IVFIndex): Serve /recommend from this approximate index over the item table
+                of `scorer` instead of ranking the whole catalog
+        """
+        self.scorer = scorer
+        self.index = index
+        self.host = host
+        self.port = port
+        self._executor = ThreadPoolExecutor(num_threads, thread_name_prefix="torchfm-scoring")
+        self._batchers = {
+            "/score": MicroBatcher(self._score, self._executor, max_batch_size, max_wait_ms, "score"),
+            "/recommend": MicroBatcher(
+                self._recommend, self._executor, max_batch_size, max_wait_ms, "recommend")
+        }
+        self._latencies = {
+            route: Histogram(f"torchfm_http{route.replace('/', '_')}_seconds", f"Latency of {route}")
+            for route in self._batchers
+        }
+        self._responses = Counter()
+        self._server: asyncio.Server = None
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    def _score(self, requests: list[dict]) -> list[dict | Exception]:
+        """Score the items of every request with one lookup over all the pairs."""
+        lengths = np.array([len(request["item_ids"]) for request in requests], dtype=np.int64)
+        user_rows, user_found = self.scorer.find_user_rows([request["user_id"] for request in requests])
+        item_rows, item_found = self.scorer.find_item_rows(np.fromiter(
+            chain.from_iterable(request["item_ids"] for request in requests),
+            dtype=np.int64, count=lengths.sum()
+        ))
+        owners = np.repeat(np.arange(len(requests)), lengths)
+        valid = user_found & (np.bincount(owners[~item_found], minlength=len(requests)) == 0)
+        keep = valid[owners]
+        scores = self.scorer.score(np.repeat(user_rows, lengths)[keep], item_rows[keep])
+        chunks = iter(np.split(scores, np.cumsum(lengths[valid])[:-1]))
+
+        results = []
+        for j, request in enumerate(requests):
+            if valid[j]:
+                results.append({"user_id": request["user_id"], "scores": next(chunks).tolist()})
+            elif not user_found[j]:
+                results.append(HTTPError(HTTPStatus.NOT_FOUND, f"User not found: {request['user_id']}."))
+            else:
+                missing = item_found[owners == j].argmin()
+                results.append(HTTPError(
+                    HTTPStatus.NOT_FOUND, f"Item not found: {request['item_ids'][missing]}."))
+        return results
+
+    def _recommend(self, requests: list[dict]) -> list[dict | Exception]:
+        """Rank the catalog for the users of every request with one matrix product."""
+        user_rows, valid = self.scorer.find_user_rows([request["user_id"] for request in requests])
+        results = []
+        if valid.any():
+            k = max(request["k"] for request, found in zip(requests, valid) if found)
+            # A request may ask for more items than the catalog has
+            k = min(k, self.scorer.num_items)
+            item_rows, scores = self.scorer.top_k(user_rows[valid], k, self.index)
+            item_ids = self.scorer.item_ids[np.maximum(item_rows, 0)]
+        n = 0
+        for j, request in enumerate(requests):
+            if not valid[j]:
+                results.append(HTTPError(HTTPStatus.NOT_FOUND, f"User not found: {request['user_id']}."))
+                continue
+            # An index may find fewer items than asked
+            found = item_rows[n, :request["k"]] >= 0
+            results.append({
+                "user_id": request["user_id"],
+                "item_ids": item_ids[n, :request["k"]][found].tolist(),
+                "scores": scores[n, :request["k"]][found].tolist()
+            })
+            n += 1
+        return results
+
+    @staticmethod
+    def _parse(route: str, body: bytes) -> dict:
+        try:
+            request = json.loads(body)
+            if route == "/score":
+                request = {
+                    "user_id": int(request["user_id"]),
+                    "item_ids": [int(id) for id in request["item_ids"]]
+                }
+            else:
+                request = {"user_id": int(request["user_id"]), "k": int(request.get("k", 10))}
+                if request["k"] <= 0:
+                    raise ValueError("`k` must be positive.")
+        except (ValueError, TypeError, KeyError) as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid request: {e!r}")
+        return request
+
+    def render_metrics(self) -> str:
+        metrics = [histogram.render() for histogram in self._latencies.values()]
+        for batcher in self._batchers.values():
+            metrics += [
+                batcher.batch_sizes.render(),
+                batcher.queue_seconds.render(),
+                batcher.process_seconds.render()
+            ]
+        lines = ["# TYPE torchfm_http_responses_total counter"]
+        for status, count in sorted(self._responses.items()):
+            lines.append(f'torchfm_http_responses_total{{status="{status}"}} {count}')
+        metrics.append("\n".join(lines))
+        return "\n".join(metrics) + "\n"
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple[str, bytes]:
+        if path == "/health":
+            return "text/plain", b"ok"
+        if path == "/metrics":
+            return "text/plain; version=0.0.4", self.render_metrics().encode()
+        if path not in self._batchers:
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+        if method != "POST":
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        start = time.perf_counter()
+        result = await self._batchers[path].submit(self._parse(path, body))
+        payload = json.dumps(result).encode()
+        self._latencies[path].observe(time.perf_counter() - start)
+        return "application/json", payload
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                keep_alive = False
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                    headers = {}
+                    while (header := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        name, _, value = header.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY_BYTES:
+                        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    body = await reader.readexactly(length)
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                    status = HTTPStatus.OK
+                    content_type, payload = await self._route(method, target.split("?")[0], body)
+                except HTTPError as e:
+                    status, content_type = e.status, "application/json"
+                    payload = json.dumps({"error": str(e)}).encode()
+                except ValueError:  # Malformed request line or headers
+                    status, content_type, payload = HTTPStatus.BAD_REQUEST, "text/plain", b"Bad request"
+                except Exception as e:
+                    logger.exception(e)
+                    status, content_type = HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain"
+                    payload = b"Internal server error"
+                self._responses[status.value] += 1
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def start(self) -> None:
+        for batcher in self._batchers.values():
+            batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Serving {self.scorer.num_users} users and {self.scorer.num_items} items "
+                    f"on http://{self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Idle keep-alive connections would hold `wait_closed` forever
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+        for batcher in self._batchers.values():
+            await batcher.stop()
+        self._executor.shutdown()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
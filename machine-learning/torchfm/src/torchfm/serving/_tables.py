@@ -0,0 +1,214 @@
+import json
+import torch
+import warnings
+import numpy as np
+from abc import ABC
+from abc import abstractmethod
+from pathlib import Path
+from torch import Tensor
+from torchfm.data._fmdataset import FMDataset
+from torchfm.data._fmdataset import write_arrays
+from torchfm.model._torchfm import TorchFM
+from torchfm.serving._ann import IVFIndex
+
+
+def _as_tensor(array: np.ndarray) -> Tensor:
+    """Wrap `array` as a tensor without copy."""
+    with warnings.catch_warnings():
+        # Memory-mapped arrays are read-only, which torch warns about but never writes to
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.from_numpy(array)
+
+
+class Scorer(ABC):
+    """Scores users against items from their representations, which subclasses provide for
+    rows of the sorted `user_ids` and `item_ids`. A score is a dot product between the two
+    embeddings plus their biases and the global `bias`.
+    """
+    user_ids: np.ndarray
+    item_ids: np.ndarray
+    bias: float
+
+    @abstractmethod
+    def user_representations(self, user_rows: np.ndarray) -> tuple[Tensor, Tensor]:
+        """Returns:
+            tuple[Tensor, Tensor]: Embeddings in shape (B, K) and biases in shape (B, )
+        """
+
+    @abstractmethod
+    def item_representations(self, item_rows: np.ndarray) -> tuple[Tensor, Tensor]:
+        pass
+
+    def item_table(self) -> tuple[Tensor, Tensor]:
+        """Representations of the whole catalog, as ranked by `top_k`."""
+        return self.item_representations(np.arange(self.num_items))
+
+    @property
+    def num_users(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def num_items(self) -> int:
+        return len(self.item_ids)
+
+    @staticmethod
+    def _find_rows(ids: np.ndarray, values) -> tuple[np.ndarray, np.ndarray]:
+        values = np.asarray(values, dtype=np.int64)
+        rows = np.searchsorted(ids, values)
+        found = rows < len(ids)
+        found[found] = ids[rows[found]] == values[found]
+        return rows, found
+
+    def find_user_rows(self, user_ids) -> tuple[np.ndarray, np.ndarray]:
+        """Returns:
+            tuple[np.ndarray, np.ndarray]: Rows of the users, and whether each one was found
+        """
+        return self._find_rows(self.user_ids, user_ids)
+
+    def find_item_rows(self, item_ids) -> tuple[np.ndarray, np.ndarray]:
+        return self._find_rows(self.item_ids, item_ids)
+
+    def get_user_rows(self, user_ids) -> np.ndarray:
+        rows, found = self.find_user_rows(user_ids)
+        if not found.all():
+            raise KeyError(f"User not found: {np.asarray(user_ids)[~found][0]}.")
+        return rows
+
+    def get_item_rows(self, item_ids) -> np.ndarray:
+        rows, found = self.find_item_rows(item_ids)
+        if not found.all():
+            raise KeyError(f"Item not found: {np.asarray(item_ids)[~found][0]}.")
+        return rows
+
+    @torch.inference_mode()
+    def score(self, user_rows: np.ndarray, item_rows: np.ndarray) -> np.ndarray:
+        """Score the pairs (user_rows[j], item_rows[j]).
+
+        Returns:
+            np.ndarray: Scores in shape (len(user_rows), )
+        """
+        u_emb, u_bias = self.user_representations(user_rows)
+        i_emb, i_bias = self.item_representations(item_rows)
+        scores = (u_emb * i_emb).sum(dim=1) + u_bias + i_bias + self.bias
+        return scores.numpy()
+
+    @torch.inference_mode()
+    def top_k(self, user_rows: np.ndarray, k: int, index: IVFIndex = None) -> tuple[np.ndarray, np.ndarray]:
+        """Rank the whole catalog for each user, or retrieve the approximate top-k from an
+        index built over `item_table()`.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Item rows and scores, in shape (len(user_rows), k).
+                An index may return fewer than k items, the missing rows are -1.
+        """
+        u_emb, u_bias = self.user_representations(user_rows)
+        if index is not None:
+            rows, scores = index.search(u_emb.numpy(), k)
+            return rows, scores + u_bias.numpy()[:, None] + self.bias
+
+        i_emb, i_bias = self.item_table()
+        scores = u_emb @ i_emb.T + i_bias[None, :]
+        # The user and global biases shift every item alike, they don't change the ranking
+        top_scores, top_rows = torch.topk(scores, min(k, self.num_items), dim=1)
+        return top_rows.numpy(), (top_scores + u_bias[:, None] + self.bias).numpy()
+
+
+class FrozenTables(Scorer):
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        user_embeddings: np.ndarray,
+        user_biases: np.ndarray,
+        item_ids: np.ndarray,
+        item_embeddings: np.ndarray,
+        item_biases: np.ndarray,
+        bias: float
+    ) -> None:
+        """The representation of every user and item of a trained model, so that a score is a
+        dot product between two rows plus their biases.
+
+        Args:
+            user_ids (np.ndarray): Sorted user ids, row `r` of the user tables is `user_ids[r]`
+            user_embeddings (np.ndarray): User embeddings in shape (U, K)
+            user_biases (np.ndarray): User biases in shape (U, )
+            item_ids (np.ndarray): Sorted item ids
+            item_embeddings (np.ndarray): Item embeddings in shape (I, K)
+            item_biases (np.ndarray): Item biases in shape (I, )
+            bias (float): Global bias
+        """
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self._user_embeddings = _as_tensor(np.asarray(user_embeddings, dtype=np.float32))
+        self._user_biases = _as_tensor(np.asarray(user_biases, dtype=np.float32))
+        self._item_embeddings = _as_tensor(np.asarray(item_embeddings, dtype=np.float32))
+        self._item_biases = _as_tensor(np.asarray(item_biases, dtype=np.float32))
+        self.bias = float(bias)
+
+    @classmethod
+    @torch.inference_mode()
+    def from_model(cls, model: TorchFM, dataset: FMDataset, batch_size: int = 4096) -> "FrozenTables":
+        """Compute the representation of every user and item of `dataset` with `model`, in
+        eval mode, then put the model back in the mode it was in.
+        """
+
+        def represent(encode_rows, representations, num_rows):
+            embeddings, biases = [], []
+            for start in range(0, num_rows, batch_size):
+                rows = np.arange(start, min(start + batch_size, num_rows))
+                emb, bias = representations(*encode_rows(rows))
+                embeddings.append(emb)
+                biases.append(bias)
+            return torch.cat(embeddings).numpy(), torch.cat(biases).numpy()
+
+        training = model.training
+        model.eval()
+        try:
+            user_embeddings, user_biases = represent(
+                dataset.encode_user_rows, model.user_representations, dataset.num_users)
+            item_embeddings, item_biases = represent(
+                dataset.encode_item_rows, model.item_representations, dataset.num_items)
+        finally:
+            model.train(training)
+        return cls(
+            dataset.get_user_ids(np.arange(dataset.num_users)), user_embeddings, user_biases,
+            dataset.get_item_ids(np.arange(dataset.num_items)), item_embeddings, item_biases,
+            model._bias.item()
+        )
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        write_arrays(path, {
+            "user_ids": self.user_ids,
+            "user_embeddings": self._user_embeddings.numpy(),
+            "user_biases": self._user_biases.numpy(),
+            "item_ids": self.item_ids,
+            "item_embeddings": self._item_embeddings.numpy(),
+            "item_biases": self._item_biases.numpy()
+        })
+        path.joinpath("meta.json").write_text(json.dumps({"bias": self.bias}))
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "FrozenTables":
+        """Load tables written by `save`, memory-mapped unless `mmap` is False."""
+        path = Path(path)
+        arrays = {
+            file.stem: np.load(file, mmap_mode="r" if mmap else None)
+            for file in path.glob("*.npy")
+        }
+        meta = json.loads(path.joinpath("meta.json").read_text())
+        return cls(**arrays, bias=meta["bias"])
+
+    @property
+    def embedding_dim(self) -> int:
+        return self._user_embeddings.shape[1]
+
+    def user_representations(self, user_rows: np.ndarray) -> tuple[Tensor, Tensor]:
+        rows = torch.from_numpy(np.asarray(user_rows, dtype=np.int64))
+        return self._user_embeddings[rows], self._user_biases[rows]
+
+    def item_representations(self, item_rows: np.ndarray) -> tuple[Tensor, Tensor]:
+        rows = torch.from_numpy(np.asarray(item_rows, dtype=np.int64))
+        return self._item_embeddings[rows], self._item_biases[rows]
+
+    def item_table(self) -> tuple[Tensor, Tensor]:
+        return self._item_embeddings, self._item_biases
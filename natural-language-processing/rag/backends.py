@@ -0,0 +1,506 @@
+import json
+import operator
+import os
+import numpy as np
+from abc import ABC
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Literal
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def default_embeddings() -> Embeddings:
+    from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+    return SentenceTransformerEmbeddings(model_name=MODEL_NAME)
+
+
+_OPERATORS = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$in": lambda value, values: value in values,
+    "$nin": lambda value, values: value not in values
+}
+
+
+def matches(fields: dict, filter: dict) -> bool:
+    """Evaluate the subset of MongoDB query documents that Atlas Vector Search filters accept,
+    equalities, comparisons, $in, $nin, $and and $or, so a filter works with every backend.
+    """
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches(fields, f) for f in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(fields, f) for f in condition):
+                return False
+        elif isinstance(condition, dict) and all(op.startswith("$") for op in condition):
+            for op, argument in condition.items():
+                if op not in _OPERATORS:
+                    raise ValueError(f"Unsupported filter operator {op}.")
+                try:
+                    if not _OPERATORS[op](fields.get(key), argument):
+                        return False
+                except TypeError:  # Comparing a missing or differently typed field
+                    return False
+        elif fields.get(key) != condition:
+            return False
+    return True
+
+
+def _with_sets(filter: dict) -> dict:
+    """Turn the lists of $in and $nin into sets, for filters evaluated over many chunks."""
+    prepared = {}
+    for key, condition in filter.items():
+        if key in ("$and", "$or"):
+            prepared[key] = [_with_sets(f) for f in condition]
+        elif isinstance(condition, dict):
+            prepared[key] = {
+                op: set(argument) if op in ("$in", "$nin") and all(
+                    isinstance(value, (str, int, float, bool)) for value in argument) else argument
+                for op, argument in condition.items()
+            }
+        else:
+            prepared[key] = condition
+    return prepared
+
+
+def embed_queries(embeddings: Embeddings, queries: list[str]) -> list[list[float]]:
+    """Embed search queries one by one with `embed_query`, as models with a query prefix or a
+    separate query encoder embed them differently from the documents.
+    """
+    return [embeddings.embed_query(query) for query in queries]
+
+
+def _indexable(value) -> bool:
+    return isinstance(value, (str, int, float, bool))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Columns of the k largest scores of every row, in decreasing order."""
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k else np.zeros((len(scores), 0), dtype=np.int64)
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+class Backend(ABC):
+    """Where a `VectorStore` keeps its chunks and their embeddings.
+
+    Filters are MongoDB query documents over the metadata of the chunks, "_id" being the id of
+    a chunk, see `matches`. `generation` counts the writes through the backend, for caches of
+    search results to notice them.
+    """
+    embeddings: Embeddings
+    generation: int = 0
+
+    @abstractmethod
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        pass
+
+    @abstractmethod
+    def add(self, documents: list[Document], vectors: list[list[float]]):
+        pass
+
+    @abstractmethod
+    def delete(self, filter: dict):
+        pass
+
+    @abstractmethod
+    def search_by_vectors(
+        self,
+        vectors: list[list[float]],
+        k: int = 4,
+        filter: dict = None
+    ) -> list[list[tuple[Document, float]]]:
+        """The k chunks most similar to each vector with their scores, the higher the closer."""
+
+    def commit(self):
+        """Make the writes durable."""
+
+    def batch_similarity_search_with_score(
+        self,
+        queries: list[str],
+        k: int = 4,
+        filter: dict = None
+    ) -> list[list[tuple[Document, float]]]:
+        return self.search_by_vectors(embed_queries(self.embeddings, queries), k, filter)
+
+    def batch_similarity_search(self, queries: list[str], k: int = 4, filter: dict = None) -> list[list[Document]]:
+        return [[doc for doc, _ in results] for results in self.batch_similarity_search_with_score(queries, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict = None) -> list[tuple[Document, float]]:
+        return self.search_by_vectors([self.embeddings.embed_query(query)], k, filter)[0]
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+
+class AtlasBackend(Backend):
+    def __init__(
+        self,
+        uri: str = None,
+        db_name: str = "langchain_db",
+        collection_name: str = "profile",
+        index_name: str = MODEL_NAME,
+        embeddings: Embeddings = None,
+        num_candidates: int = 10,
+        num_threads: int = 8
+    ):
+        """A MongoDB Atlas collection searched with $vectorSearch. The fields used in filters
+        must be declared as filter fields of the search index.
+
+        Args:
+            uri (str): Defaults to the MONGO_CLUSTER_URI environment variable
+            num_candidates (int): Candidates considered by the search per result
+            num_threads (int): Queries of a batch run concurrently
+        """
+        try:
+            import pymongo
+            from langchain_mongodb import MongoDBAtlasVectorSearch
+        except ImportError as e:
+            raise ImportError("AtlasBackend requires pymongo and langchain-mongodb, "
+                              "install them with `pip install pymongo langchain-mongodb`.") from e
+        self.client = pymongo.MongoClient(uri or os.environ["MONGO_CLUSTER_URI"])
+        self.collection = self.client[db_name][collection_name]
+        self.embeddings = embeddings if embeddings is not None else default_embeddings()
+        self.index_name = index_name
+        self.num_candidates = num_candidates
+        self.vector_search = MongoDBAtlasVectorSearch(
+            collection=self.collection,
+            embedding=self.embeddings,
+            index_name=index_name,
+            text_key="text",
+            embedding_key="embedding"
+        )
+        self._executor = ThreadPoolExecutor(num_threads)
+
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        return {doc["_id"] for doc in self.collection.find({"_id": {"$in": list(ids)}}, {"_id": 1})}
+
+    def add(self, documents: list[Document], vectors: list[list[float]]):
+        if documents:
+            self.generation += 1
+            self.collection.insert_many([
+                {"_id": doc.id, "text": doc.page_content, "embedding": list(vector), **doc.metadata}
+                for doc, vector in zip(documents, vectors)
+            ], ordered=False)
+
+    def delete(self, filter: dict):
+        if self.collection.delete_many(filter).deleted_count:
+            self.generation += 1
+
+    def _search(self, vector: list[float], k: int, filter: dict) -> list[tuple[Document, float]]:
+        stage = {
+            "index": self.index_name,
+            "path": "embedding",
+            "queryVector": list(vector),
+            "numCandidates": k * self.num_candidates,
+            "limit": k
+        }
+        if filter:
+            stage["filter"] = filter
+        results = []
+        for doc in self.collection.aggregate([
+            {"$vectorSearch": stage},
+            {"$set": {"score": {"$meta": "vectorSearchScore"}}},
+            {"$project": {"embedding": 0}}
+        ]):
+            score, id, text = doc.pop("score"), str(doc.pop("_id")), doc.pop("text")
+            results.append((Document(page_content=text, metadata=doc, id=id), score))
+        return results
+
+    def search_by_vectors(
+        self,
+        vectors: list[list[float]],
+        k: int = 4,
+        filter: dict = None
+    ) -> list[list[tuple[Document, float]]]:
+        return list(self._executor.map(lambda vector: self._search(vector, k, filter), vectors))
+
+
+def _spherical_kmeans(x: np.ndarray, num_lists: int, num_iters: int, rng: np.random.Generator) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity. A centroid is the normalized sum of its
+    vectors, and a list left empty takes the vector worst fitted by its own centroid.
+    """
+    centroids = x[rng.choice(len(x), num_lists, replace=False)].copy()
+    for _ in range(num_iters):
+        similarities = x @ centroids.T
+        assignment = similarities.argmax(axis=1)
+        counts = np.bincount(assignment, minlength=num_lists)
+        filled = counts > 0
+        sums = np.zeros_like(centroids)
+        starts = np.cumsum(counts) - counts
+        sums[filled] = np.add.reduceat(x[np.argsort(assignment, kind="stable")], starts[filled])
+        centroids = _normalize(sums)
+        if not filled.all():
+            fit = np.take_along_axis(similarities, assignment[:, None], axis=1)[:, 0]
+            centroids[~filled] = x[np.argsort(fit)[:(~filled).sum()]]
+    return centroids
+
+
+class LocalBackend(Backend):
+    def __init__(
+        self,
+        path: str,
+        embeddings: Embeddings = None,
+        index: Literal["exact", "ivf"] = "exact",
+        num_lists: int = None,
+        nprobe: int = 8,
+        num_iters: int = 20,
+        seed: int = 0
+    ):
+        """An in-process index persisted in the directory `path`, which is loaded if it exists.
+
+        The embeddings are normalized and searched by cosine similarity. They are stored as
+        one float32 matrix, memory-mapped once committed, with the texts and metadata in a
+        JSON lines file. A batch of queries is scored with one matrix product.
+
+        With `index="ivf"` the matrix is clustered by k-means into `num_lists` lists when
+        committed, and a query only scores the chunks of the `nprobe` lists whose centroids
+        are the most similar. Filters selecting fewer chunks than a probe would scan, and
+        uncommitted writes, are searched exactly.
+
+        Args:
+            path (str): Directory of the index
+            embeddings (Embeddings): Defaults to all-MiniLM-L6-v2
+            index (str): Exact or IVF search
+            num_lists (int): Number of IVF lists, defaults to sqrt of the number of chunks
+            nprobe (int): IVF lists scanned per query
+            num_iters (int): Iterations of k-means
+            seed (int): Seed of k-means
+        """
+        self.path = Path(path)
+        self.embeddings = embeddings if embeddings is not None else default_embeddings()
+        self.index = index
+        self.num_lists = num_lists
+        self.nprobe = nprobe
+        self.num_iters = num_iters
+        self.seed = seed
+        self._vectors = None  # Committed rows, memory-mapped
+        self._pending = []  # Added rows, not committed yet
+        self._matrix = None
+        self._ids, self._texts, self._metadatas = [], [], []
+        self._rows = {}  # Id to row of the alive chunks
+        self._sources = {}  # Source to rows of the alive chunks, to narrow deletes by source
+        self._alive = np.zeros(0, dtype=bool)
+        self._centroids = None
+        self._indptr = None
+        self._dirty = False
+        if self.path.joinpath("meta.json").exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _load(self):
+        self._vectors = np.load(self.path.joinpath("vectors.npy"), mmap_mode="r")
+        with open(self.path.joinpath("documents.jsonl")) as f:
+            for line in f:
+                id, text, metadata = json.loads(line)
+                self._ids.append(id)
+                self._texts.append(text)
+                self._metadatas.append(metadata)
+                self._index_row(len(self._ids) - 1)
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._matrix = self._vectors
+        if self.path.joinpath("centroids.npy").exists():
+            self._centroids = np.load(self.path.joinpath("centroids.npy"))
+            self._indptr = np.load(self.path.joinpath("indptr.npy"))
+
+    def get_existing_ids(self, ids: list[str]) -> set[str]:
+        return {id for id in ids if id in self._rows}
+
+    def add(self, documents: list[Document], vectors: list[list[float]]):
+        if not documents:
+            return
+        vectors = _normalize(vectors)
+        if self._matrix is not None and len(self._matrix) and vectors.shape[1] != self._matrix.shape[1]:
+            raise ValueError(f"Expected embeddings of size {self._matrix.shape[1]}, got {vectors.shape[1]}.")
+        # Adding an existing id replaces it
+        self._drop([self._rows[doc.id] for doc in documents if doc.id in self._rows])
+        for doc in documents:
+            self._ids.append(doc.id)
+            self._texts.append(doc.page_content)
+            self._metadatas.append(dict(doc.metadata))
+            self._index_row(len(self._ids) - 1)
+        self._alive = np.append(self._alive, np.ones(len(documents), dtype=bool))
+        self._pending.append(vectors)
+        self._matrix = None
+        self._dirty = True
+        self.generation += 1
+
+    def _index_row(self, row: int):
+        self._rows[self._ids[row]] = row
+        source = self._metadatas[row].get("source")
+        if _indexable(source):
+            self._sources.setdefault(source, set()).add(row)
+
+    def _candidates(self, filter: dict) -> set[int] | None:
+        """Rows that can match `filter`, from the id and source maps when it pins "_id" or
+        "source" to values, with an equality or $in. None when it pins neither.
+        """
+        candidates = None
+        for key, rows_of in [("_id", lambda id: {self._rows[id]} if id in self._rows else set()),
+                             ("source", lambda source: self._sources.get(source, set()))]:
+            condition = filter.get(key)
+            if isinstance(condition, dict):
+                if set(condition) == {"$eq"}:
+                    values = [condition["$eq"]]
+                elif set(condition) == {"$in"}:
+                    values = condition["$in"]
+                else:
+                    continue
+            elif condition is not None:
+                values = [condition]
+            else:
+                continue
+            if not all(_indexable(value) for value in values):
+                continue
+            rows = set().union(*[rows_of(value) for value in values])
+            candidates = rows if candidates is None else candidates & rows
+        return candidates
+
+    def _fields(self, row: int) -> dict:
+        return {**self._metadatas[row], "_id": self._ids[row]}
+
+    def _mask(self, filter: dict = None) -> np.ndarray:
+        if not filter:
+            return self._alive
+        filter = _with_sets(filter)
+        # Deletes by source, as ingestion issues for every batch, only test the chunks of the
+        # sources instead of every chunk
+        candidates = self._candidates(filter)
+        if candidates is None:
+            rows = np.flatnonzero(self._alive)
+        else:
+            rows = np.fromiter(sorted(candidates), dtype=np.int64, count=len(candidates))
+        mask = np.zeros(len(self._alive), dtype=bool)
+        mask[rows] = [matches(self._fields(row), filter) for row in rows]
+        return mask
+
+    def _drop(self, rows: list[int]):
+        for row in rows:
+            del self._rows[self._ids[row]]
+            source = self._metadatas[row].get("source")
+            if _indexable(source):
+                self._sources[source].discard(row)
+                if not self._sources[source]:
+                    del self._sources[source]
+        if len(rows):
+            self._alive[rows] = False
+            self._dirty = True
+            self.generation += 1
+
+    def delete(self, filter: dict):
+        self._drop(np.flatnonzero(self._mask(filter)))
+
+    def _get_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            parts = ([self._vectors] if self._vectors is not None else []) + self._pending
+            self._matrix = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+            self._vectors, self._pending = self._matrix, []
+        return self._matrix
+
+    def commit(self):
+        """Write the index, compacting the deleted rows and clustering the IVF lists again."""
+        if not self._dirty:
+            return
+        keep = np.flatnonzero(self._alive)
+        vectors = np.ascontiguousarray(self._get_matrix()[keep])
+        self._centroids = self._indptr = None
+        if self.index == "ivf" and len(vectors):
+            num_lists = min(self.num_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+            rng = np.random.default_rng(self.seed)
+            sample = vectors
+            if len(vectors) > 256 * num_lists:
+                sample = vectors[rng.choice(len(vectors), 256 * num_lists, replace=False)]
+            self._centroids = _spherical_kmeans(sample, num_lists, self.num_iters, rng)
+            assignment = (vectors @ self._centroids.T).argmax(axis=1)
+            # Sorted by list, the chunks of a list are adjacent rows of the memory-mapped matrix
+            order = np.argsort(assignment, kind="stable")
+            self._indptr = np.searchsorted(assignment[order], np.arange(num_lists + 1))
+            keep, vectors = keep[order], vectors[order]
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        arrays = {"vectors": vectors}
+        if self._centroids is not None:
+            arrays.update(centroids=self._centroids, indptr=self._indptr)
+        for name in ["centroids", "indptr"]:
+            if name not in arrays:
+                self.path.joinpath(f"{name}.npy").unlink(missing_ok=True)
+        for name, array in arrays.items():
+            # Written aside then renamed, so a reader never maps a partial file
+            np.save(self.path.joinpath(f"{name}.tmp.npy"), array)
+            os.replace(self.path.joinpath(f"{name}.tmp.npy"), self.path.joinpath(f"{name}.npy"))
+        with open(self.path.joinpath("documents.jsonl.tmp"), "w") as f:
+            for row in keep:
+                f.write(json.dumps([self._ids[row], self._texts[row], self._metadatas[row]]) + "\n")
+        os.replace(self.path.joinpath("documents.jsonl.tmp"), self.path.joinpath("documents.jsonl"))
+        self.path.joinpath("meta.json").write_text(json.dumps({
+            "count": len(keep), "dim": vectors.shape[1] if vectors.ndim == 2 else 0, "index": self.index
+        }))
+
+        self._ids = [self._ids[row] for row in keep]
+        self._texts = [self._texts[row] for row in keep]
+        self._metadatas = [self._metadatas[row] for row in keep]
+        self._rows, self._sources = {}, {}
+        for row in range(len(self._ids)):
+            self._index_row(row)
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._vectors = self._matrix = np.load(self.path.joinpath("vectors.npy"), mmap_mode="r")
+        self._dirty = False
+
+    def _results(self, rows: np.ndarray, scores: np.ndarray) -> list[tuple[Document, float]]:
+        return [
+            (Document(page_content=self._texts[row], metadata=dict(self._metadatas[row]), id=self._ids[row]),
+             float(score))
+            for row, score in zip(rows, scores)
+        ]
+
+    def search_by_vectors(
+        self,
+        vectors: list[list[float]],
+        k: int = 4,
+        filter: dict = None
+    ) -> list[list[tuple[Document, float]]]:
+        queries = _normalize(vectors)
+        matrix = self._get_matrix()
+        mask = self._mask(filter)
+        if len(queries) == 0 or not mask.any():
+            return [[] for _ in queries]
+
+        num_lists = len(self._centroids) if self._centroids is not None else 0
+        nprobe = min(self.nprobe, num_lists)
+        if num_lists and not self._dirty and mask.sum() > len(matrix) * nprobe / num_lists:
+            probes = _top_k(queries @ self._centroids.T, nprobe)
+            results = []
+            for query, lists in zip(queries, probes):
+                rows = np.concatenate([np.arange(self._indptr[l], self._indptr[l + 1]) for l in lists])
+                rows = rows[mask[rows]]
+                scores = matrix[rows] @ query
+                top = _top_k(scores[None, :], k)[0]
+                results.append(self._results(rows[top], scores[top]))
+            return results
+
+        rows = np.flatnonzero(mask)
+        candidates = matrix if len(rows) == len(matrix) else matrix[rows]
+        scores = queries @ candidates.T  # Output (B, R)
+        top = _top_k(scores, k)
+        return [
+            self._results(rows[columns], row_scores[columns])
+            for columns, row_scores in zip(top, scores)
+        ]
@@ -1,17 +1,165 @@
-from langchain_community.chat_models import ChatCohere
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate
+from rag.backends import embed_queries
+
+TEMPLATE_PATH = Path(__file__).with_name("inference_template.txt")
+
+
+@lru_cache(maxsize=None)
+def load_prompt(path: Path = TEMPLATE_PATH) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([("ai", Path(path).read_text())])
+
+
+def default_llm() -> BaseChatModel:
+    try:
+        from langchain_community.chat_models import ChatCohere
+        return ChatCohere()
+    except ImportError as e:
+        raise ImportError("The default LLM is Cohere, install it with `pip install cohere`, "
+                          "or pass an `llm`.") from e
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
 
 class InferenceService():
-    def __init__(self, vector_search):
-        llm = ChatCohere()
-        prompt = ChatPromptTemplate.from_messages([
-            ("ai", open("rag/inference_template.txt").read())
-        ])
+    def __init__(
+        self,
+        vector_search,
+        llm: BaseChatModel = None,
+        k: int = 1,
+        cache_size: int = 1024,
+        cache_ttl: float = 300
+    ):
+        """Answer questions from the chunks of `vector_search` most similar to them.
+
+        The questions are embedded and searched in batches, and the embeddings and retrieved
+        chunks of recent questions are cached. Under asyncio, the retrievals of the concurrent
+        calls of a loop iteration share one batch, run on a thread while other answers are
+        generated.
+
+        Args:
+            vector_search: A `Backend` of a `VectorStore`, or a LangChain vector store
+            llm (BaseChatModel): Defaults to Cohere, e.g. a `GenericFakeChatModel` in tests
+            k (int): Chunks retrieved per question
+            cache_size (int): Questions whose embedding and chunks are cached
+            cache_ttl (float): Seconds the retrieved chunks of a question are reused. They are
+                dropped sooner when the `generation` of a backend shows it was written to,
+                writes by other processes are only seen once they expire.
+        """
         self.retriever = vector_search
-        self.chain = prompt | llm
-        
+        self.llm = llm if llm is not None else default_llm()
+        self.chain = load_prompt() | self.llm
+        self.k = k
+        self.cache_ttl = cache_ttl
+        self._embeddings = LRUCache(cache_size)
+        self._retrievals = LRUCache(cache_size)
+        self._pending = []
+
+    def _embed(self, questions: list[str]) -> list[list[float]]:
+        vectors = {question: self._embeddings.get(question) for question in questions}
+        missing = [question for question, vector in vectors.items() if vector is None]
+        if missing:
+            for question, vector in zip(missing, embed_queries(self.retriever.embeddings, missing)):
+                self._embeddings.put(question, vector)
+                vectors[question] = vector
+        return [vectors[question] for question in questions]
+
+    def _cached(self, question: str) -> list[Document] | None:
+        entry = self._retrievals.get((question, self.k))
+        if entry is None:
+            return None
+        generation, expires, docs = entry
+        if generation != getattr(self.retriever, "generation", 0) or time.monotonic() > expires:
+            return None
+        return docs
+
+    def retrieve(self, questions: list[str]) -> list[list[Document]]:
+        """Chunks of every question, embedding and searching the uncached ones at once."""
+        results = {question: self._cached(question) for question in questions}
+        missing = [question for question, docs in results.items() if docs is None]
+        if missing:
+            # Read before searching, so results racing a write are not cached as current
+            generation = getattr(self.retriever, "generation", 0)
+            vectors = self._embed(missing)
+            if hasattr(self.retriever, "search_by_vectors"):
+                found = [[doc for doc, _ in hits] for hits in self.retriever.search_by_vectors(vectors, self.k)]
+            else:
+                found = [self.retriever.similarity_search_by_vector(vector, k=self.k) for vector in vectors]
+            for question, docs in zip(missing, found):
+                self._retrievals.put((question, self.k), (generation, time.monotonic() + self.cache_ttl, docs))
+                results[question] = docs
+        return [results[question] for question in questions]
+
+    @staticmethod
+    def _inputs(question: str, docs: list[Document]) -> dict:
+        return {"context": "\n\n".join(doc.page_content for doc in docs), "question": question}
+
     def invoke(self, question):
-        context = self.retriever.similarity_search(question, k=1)[0].page_content
-        return self.chain.invoke({
-            "context": context, "question": question
-        })
\ No newline at end of file
+        return self.chain.invoke(self._inputs(question, self.retrieve([question])[0]))
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        task = asyncio.ensure_future(asyncio.to_thread(self.retrieve, [question for question, _ in pending]))
+
+        def resolve(task):
+            for i, (_, future) in enumerate(pending):
+                if future.cancelled():
+                    continue
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result()[i])
+        task.add_done_callback(resolve)
+
+    async def aretrieve(self, question: str) -> list[Document]:
+        docs = self._cached(question)
+        if docs is not None:
+            return docs
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((question, future))
+        if len(self._pending) == 1:
+            # The questions asked until the loop gets back to it are retrieved with this one
+            loop.call_soon(self._flush)
+        return await future
+
+    async def ainvoke(self, question: str):
+        return await self.chain.ainvoke(self._inputs(question, await self.aretrieve(question)))
+
+    async def abatch(self, questions: list[str]) -> list:
+        docs = await asyncio.gather(*[self.aretrieve(question) for question in questions])
+        return await self.chain.abatch([self._inputs(q, d) for q, d in zip(questions, docs)])
+
+    async def astream(self, question: str) -> AsyncIterator[str]:
+        """Tokens of the answer as the LLM generates them."""
+        async for chunk in self.chain.astream(self._inputs(question, await self.aretrieve(question))):
+            yield chunk.content
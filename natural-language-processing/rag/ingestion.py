@@ -0,0 +1,107 @@
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from langchain_community.document_loaders import TextLoader
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+def content_hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def iter_paths(paths: list[str], pattern: str = "**/*.txt"):
+    """Yield the files of `paths`, walking directories for `pattern`."""
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(p for p in path.glob(pattern) if p.is_file())
+        else:
+            yield path
+
+
+def load_chunks(path: Path, chunk_size: int = 1000, chunk_overlap: int = 200) -> list[Document]:
+    """Split a file into overlapping chunks, each identified by the hash of its source, position
+    and text, so re-indexing an unchanged file yields the same ids.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = splitter.split_documents(TextLoader(str(path), autodetect_encoding=True).load())
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["source"] = str(path)
+        chunk.metadata["chunk"] = i
+        chunk.id = content_hash(str(path), str(i), chunk.page_content)
+    return chunks
+
+
+class EmbeddingCache:
+    def __init__(self, path: str):
+        """Embeddings on disk keyed by model and text hash, shared by every run re-indexing the
+        same corpus. It is safe to use from several threads.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT, hash TEXT, embedding BLOB, PRIMARY KEY (model, hash))"
+        )
+        self.lock = threading.Lock()
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self.lock:
+            # SQLite limits the number of parameters of a statement
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT hash, embedding FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({','.join('?' * len(batch))})", [model, *batch]
+                )
+                for hash, blob in rows:
+                    found[hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, items: dict[str, list[float]]):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(model, h, np.asarray(e, dtype=np.float32).tobytes()) for h, e in items.items()]
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def embed_texts(
+    texts: list[str],
+    embeddings: Embeddings,
+    model: str,
+    cache: EmbeddingCache = None,
+    batch_size: int = 256,
+    num_workers: int = 4
+) -> tuple[list[list[float]], int]:
+    """Embed `texts`, reading the cached ones and embedding the others in batches of
+    `batch_size` on `num_workers` threads. The models release the GIL while they compute.
+
+    Returns:
+        tuple: The embeddings in the order of `texts`, and how many were computed
+    """
+    hashes = [content_hash(text) for text in texts]
+    vectors = cache.get_many(model, list(set(hashes))) if cache is not None else {}
+    missing = list(dict.fromkeys(h for h in hashes if h not in vectors))
+    text_of = dict(zip(hashes, texts))
+
+    def embed(batch):
+        computed = dict(zip(batch, embeddings.embed_documents([text_of[h] for h in batch])))
+        if cache is not None:
+            cache.put_many(model, computed)
+        return computed
+
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    with ThreadPoolExecutor(num_workers) as executor:
+        for computed in executor.map(embed, batches):
+            vectors.update(computed)
+    return [vectors[h] for h in hashes], len(missing)
@@ -1,25 +1,73 @@
-import os
-import pymongo
-from langchain_mongodb import MongoDBAtlasVectorSearch
-from langchain_community.document_loaders import TextLoader
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+from rag.backends import AtlasBackend
+from rag.backends import Backend
+from rag.ingestion import EmbeddingCache
+from rag.ingestion import embed_texts
+from rag.ingestion import iter_paths
+from rag.ingestion import load_chunks
 
 
 class VectorStore:
-    def __init__(self):
-        uri = os.environ["MONGO_CLUSTER_URI"]
-        self.client = pymongo.MongoClient(uri)
-        self.db_name = "langchain_db"
-        self.col_name = "profile"
-        self.search_index = "all-MiniLM-L6-v2"
-        self.embeddings = SentenceTransformerEmbeddings(model_name=self.search_index)
-        self.vector_search = MongoDBAtlasVectorSearch(
-            collection=self.client[self.db_name][self.col_name], 
-            embedding=self.embeddings,
-            index_name=self.search_index
-        )
+    def __init__(self, backend: Backend = None, cache_path: str = ".cache/embeddings.sqlite"):
+        """Chunks of documents and their embeddings, kept by `backend`, MongoDB Atlas by default
+        or a `LocalBackend` for an in-process index.
+        """
+        self.backend = backend if backend is not None else AtlasBackend()
+        self.embeddings = self.backend.embeddings
+        self.model_name = getattr(self.embeddings, "model_name", type(self.embeddings).__name__)
+        # Searched by `InferenceService`
+        self.vector_search = self.backend
+        self.cache = EmbeddingCache(cache_path) if cache_path is not None else None
+
+    def add_document(self, path_to_doc: str, **kwargs):
+        return self.add_documents([path_to_doc], **kwargs)
+
+    def add_documents(
+        self,
+        paths: list[str],
+        pattern: str = "**/*.txt",
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        batch_size: int = 256,
+        num_workers: int = 4,
+        write_batch_size: int = 1000
+    ) -> dict:
+        """Index files and directories, walked for `pattern`, in overlapping chunks.
 
-    def add_document(self, path_to_doc: str):
-        loader = TextLoader(path_to_doc)
-        self.vector_search.add_documents(loader.load())
+        The chunks are identified by their content, so chunks already in the collection are
+        skipped and the chunks a file no longer has are deleted. The others are embedded in
+        batches of `batch_size` on `num_workers` threads, through the embedding cache, and
+        written `write_batch_size` at a time.
 
+        Returns:
+            dict: Counts of the chunks seen, written and embedded, and of the files
+        """
+        stats = {"files": 0, "chunks": 0, "written": 0, "embedded": 0}
+        pending = {}
+        for path in iter_paths(paths, pattern):
+            pending[str(path)] = load_chunks(path, chunk_size, chunk_overlap)
+            stats["files"] += 1
+            if sum(map(len, pending.values())) >= write_batch_size:
+                self._write(pending, batch_size, num_workers, stats)
+                pending = {}
+        if pending:
+            self._write(pending, batch_size, num_workers, stats)
+        self.backend.commit()
+        return stats
+
+    def _write(self, pending: dict, batch_size: int, num_workers: int, stats: dict):
+        chunks = [chunk for file_chunks in pending.values() for chunk in file_chunks]
+        existing = self.backend.get_existing_ids([chunk.id for chunk in chunks])
+        new = [chunk for chunk in chunks if chunk.id not in existing]
+        vectors, embedded = embed_texts(
+            [chunk.page_content for chunk in new], self.embeddings, self.model_name,
+            self.cache, batch_size, num_workers
+        )
+        # The ids of the chunks depend on their source, so these are the chunks the files lost
+        self.backend.delete({
+            "source": {"$in": list(pending)},
+            "_id": {"$nin": [chunk.id for chunk in chunks]}
+        })
+        self.backend.add(new, vectors)
+        stats["chunks"] += len(chunks)
+        stats["written"] += len(new)
+        stats["embedded"] += embedded